@@ -0,0 +1,232 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from audio_format import AudioFormatError, cut_range
+from metadata_index import MetadataIndex
+from protocol import (HEADER_SIZE, MSG_DATA, MSG_END, MSG_ERROR, MSG_JSON, MSG_REQUEST, ProtocolError,
+                      pack_frame, pack_header, pack_json, unpack_header)
+from server import (AUDIO_DIR, CHUNK_SIZE, CUT_WORKERS, HOST, MAX_REQUEST_SIZE, METADATA_FILE, PORT, WATCH_AUDIO_DIR,
+                    WATCH_POLL_INTERVAL, check_cut, check_output, requested_files, unknown_files)
+from stats import ServerStats
+from watcher import AudioDirWatcher
+
+FFMPEG = os.getenv("FFMPEG", "ffmpeg")
+
+
+class Connection:
+    def __init__(self, reader, writer, stats):
+        self.stats = stats
+        self.reader = reader
+        self.writer = writer
+        self.peer = writer.get_extra_info("peername")
+        # Кадры разных запросов могут чередоваться, но сам кадр пишется целиком
+        self.write_lock = asyncio.Lock()
+        self.tasks = set()
+
+    async def write_frame(self, frame):
+        async with self.write_lock:
+            self.writer.write(frame)
+            await self.writer.drain()
+        self.stats.bytes_sent += len(frame)
+
+    async def send_error(self, request_id, message):
+        self.stats.errors += 1
+        await self.write_frame(pack_json(MSG_ERROR, request_id, {"error": message}))
+
+    async def send_file_range(self, request_id, prefix, path, offset, length):
+        loop = asyncio.get_running_loop()
+        async with self.write_lock:
+            self.writer.write(pack_header(MSG_DATA, request_id, len(prefix) + length) + prefix)
+            with open(path, "rb") as f:
+                await loop.sendfile(self.writer.transport, f, offset, length)
+            self.writer.write(pack_frame(MSG_END, request_id))
+            await self.writer.drain()
+        self.stats.bytes_sent += HEADER_SIZE * 2 + len(prefix) + length
+
+
+class AsyncAudioServer:
+    def __init__(self, host, port, cut_workers=CUT_WORKERS):
+        self.address = (host, port)
+        self.metadata_index = MetadataIndex(AUDIO_DIR, METADATA_FILE)
+        self.encoders = asyncio.Semaphore(cut_workers)
+        self.stats = ServerStats()
+        self.connections = set()
+
+    def generate_metadata(self):
+        self.metadata_index.load()
+        changed = self.metadata_index.refresh()
+        logging.info(f"Метаданные обновлены, изменено файлов: {len(changed)}.")
+
+    def apply_metadata(self, removed, updated):
+        changed = self.metadata_index.apply(removed, updated)
+        if changed:
+            logging.info(f"Каталог изменился, обновлены метаданные: {', '.join(sorted(changed))}")
+
+    async def read_frame(self, reader):
+        msg_type, request_id, length = unpack_header(await reader.readexactly(HEADER_SIZE))
+        if length > MAX_REQUEST_SIZE:
+            raise ProtocolError(f"Слишком большой кадр: {length} байт")
+        return msg_type, request_id, await reader.readexactly(length)
+
+    async def handle_client(self, reader, writer):
+        conn = Connection(reader, writer, self.stats)
+        self.connections.add(conn)
+        logging.info(f"Новое подключение от {conn.peer}")
+        try:
+            while True:
+                msg_type, request_id, payload = await self.read_frame(reader)
+                # Каждый запрос обрабатывается отдельной задачей, поэтому клиент может их конвейеризовать
+                task = asyncio.create_task(self.handle_frame(conn, msg_type, request_id, payload))
+                conn.tasks.add(task)
+                task.add_done_callback(conn.tasks.discard)
+        except asyncio.IncompleteReadError:
+            logging.info("Клиент отключен")
+        except ProtocolError as e:
+            logging.error(f"Ошибка протокола: {e}")
+        except ConnectionError as e:
+            logging.error(f"Ошибка при приеме данных: {e}")
+        finally:
+            self.connections.discard(conn)
+            for task in conn.tasks:
+                task.cancel()
+            writer.close()
+
+    async def handle_frame(self, conn, msg_type, request_id, payload):
+        if msg_type != MSG_REQUEST:
+            logging.warning(f"[{conn.peer}] Неожиданный тип кадра {msg_type}")
+            await conn.send_error(request_id, "Ожидался кадр запроса")
+            return
+        try:
+            command = json.loads(payload.decode("utf-8"))
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            logging.warning(f"[{conn.peer}] Некорректный JSON")
+            await conn.send_error(request_id, "Некорректный формат запроса")
+            return
+        if not isinstance(command, dict):
+            await conn.send_error(request_id, "Некорректный формат запроса")
+            return
+        action = command.get("action")
+        started = time.perf_counter()
+        try:
+            await self.handle_request(conn, request_id, command)
+        except ConnectionError as e:
+            logging.error(f"Ошибка при отправке данных: {e}")
+            return
+        except Exception as e:
+            # Иначе задача завершится молча, а клиент так и будет ждать ответа на этот запрос
+            logging.error(f"[{conn.peer}] Ошибка при обработке запроса {request_id}: {e}")
+            try:
+                await conn.send_error(request_id, "Не удалось обработать запрос.")
+            except ConnectionError:
+                pass
+            return
+        if action in ("list", "cut", "stats"):
+            self.stats.requests[action] += 1
+            self.stats.record(f"total.{action}", time.perf_counter() - started)
+
+    async def handle_request(self, conn, request_id, command):
+        unknown = unknown_files(self.metadata_index, requested_files(command))
+        if unknown:
+            # Длительность новых файлов определяется в потоке, чтобы не останавливать остальные соединения
+            loop = asyncio.get_running_loop()
+            self.apply_metadata(*await loop.run_in_executor(None, self.metadata_index.collect, unknown))
+        action = command.get("action")
+        if action == "list":
+            logging.info(f"[{conn.peer}] Запрос списка файлов")
+            try:
+                response = self.metadata_index.list_payload(command)
+            except ValueError as e:
+                await conn.send_error(request_id, str(e))
+                return
+            await conn.write_frame(pack_frame(MSG_JSON, request_id, response))
+
+        elif action == "stats":
+            snapshot = self.stats.snapshot(clients=len(self.connections), files=len(self.metadata_index.entries))
+            await conn.write_frame(pack_json(MSG_JSON, request_id, snapshot))
+
+        elif action == "cut":
+            cut, error = check_cut(self.metadata_index, conn.peer, command)
+            if not error:
+                options, error = check_output(command, cut[0])
+            if error:
+                await conn.send_error(request_id, error)
+                return
+            file, file_path, start, end = cut
+
+            logging.info(f"[{conn.peer}] Обрезка файла '{file}' с {start} сек до {end} сек")
+            if not command.get("exact") and not options:
+                loop = asyncio.get_running_loop()
+                scan_started = time.perf_counter()
+                try:
+                    prefix, offset, length = await loop.run_in_executor(None, cut_range, file_path, start, end)
+                except (AudioFormatError, OSError) as e:
+                    logging.warning(f"[{conn.peer}] Копирование кадров недоступно ({e}), перекодирование")
+                else:
+                    self.stats.record("scan", time.perf_counter() - scan_started)
+                    await conn.send_file_range(request_id, prefix, file_path, offset, length)
+                    logging.info(f"[{conn.peer}] Отправлен обрезанный файл '{file}' ({start}-{end} сек)")
+                    return
+
+            if await self.stream_export(conn, request_id, file_path, start, end, options):
+                logging.info(f"[{conn.peer}] Отправлен обрезанный файл '{file}' ({start}-{end} сек)")
+
+        else:
+            logging.warning(f"[{conn.peer}] Неизвестное действие '{action}'")
+            await conn.send_error(request_id, "Неизвестное действие.")
+
+    async def stream_export(self, conn, request_id, file_path, start, end, options=None):
+        # Кодировщик пишет в канал, и каждая готовая порция сразу уходит клиенту отдельным кадром DATA
+        options = options or {}
+        file_format = options.get("format") or file_path.split('.')[-1]
+        encoding = []
+        if options.get("bitrate"):
+            encoding += ["-b:a", f"{options['bitrate']}k"]
+        if options.get("sample_rate"):
+            encoding += ["-ar", str(options["sample_rate"])]
+        async with self.encoders:
+            started = time.perf_counter()
+            process = await asyncio.create_subprocess_exec(
+                FFMPEG, "-v", "error", "-ss", str(start), "-t", str(end - start), "-i", file_path,
+                "-map", "0:a", *encoding, "-f", file_format, "pipe:1",
+                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+            try:
+                while True:
+                    chunk = await process.stdout.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    await conn.write_frame(pack_frame(MSG_DATA, request_id, chunk))
+                stderr = await process.stderr.read()
+                code = await process.wait()
+            finally:
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+            self.stats.record("export", time.perf_counter() - started)
+
+        if code != 0:
+            logging.error(f"[{conn.peer}] Ошибка кодирования '{file_path}': {stderr.decode(errors='replace')}")
+            await conn.send_error(request_id, "Не удалось обработать аудиофайл.")
+            return False
+        await conn.write_frame(pack_frame(MSG_END, request_id))
+        return True
+
+    async def serve(self):
+        self.generate_metadata()
+        if WATCH_AUDIO_DIR:
+            loop = asyncio.get_running_loop()
+            AudioDirWatcher(AUDIO_DIR, lambda names: loop.call_soon_threadsafe(
+                self.apply_metadata, *self.metadata_index.collect(names)), WATCH_POLL_INTERVAL).start()
+        server = await asyncio.start_server(self.handle_client, *self.address, limit=CHUNK_SIZE)
+        logging.info(f"Асинхронный сервер запущен на {self.address[0]}:{self.address[1]}")
+        async with server:
+            await server.serve_forever()
+
+    def run(self):
+        asyncio.run(self.serve())
+
+
+if __name__ == "__main__":
+    server = AsyncAudioServer(HOST, PORT)
+    server.run()
@@ -0,0 +1,294 @@
+import os
+import sys
+import json
+import math
+import time
+import wave
+import random
+import signal
+import socket
+import argparse
+import platform
+import threading
+import subprocess
+from array import array
+from client import HOST, PORT, AudioClient
+from protocol import MSG_DATA, MSG_ERROR, recv_exact, recv_header
+from stats import LatencyHistogram
+
+# Генератор нагрузки: N соединений по кругу отправляют смесь запросов list/cut и ждут ответ,
+# после чего печатается пропускная способность, перцентили задержки и память сервера
+
+FIXTURES_DIR = "bench_audio"
+FFMPEG = os.getenv("FFMPEG", "ffmpeg")
+SAMPLE_RATE = 44100
+
+
+class Discard:
+    # Приемник для receive_into: тело ответа не сохраняется, только считается
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        return len(data)
+
+
+def write_tone(path, seconds, frequency):
+    # Синусоида с медленной огибающей, чтобы у фикстур был непостоянный уровень
+    frames = array("h")
+    for i in range(int(seconds * SAMPLE_RATE)):
+        t = i / SAMPLE_RATE
+        level = 0.3 + 0.2 * math.sin(2 * math.pi * 0.25 * t)
+        value = int(32767 * level * math.sin(2 * math.pi * frequency * t))
+        frames.extend((value, value))
+    if sys.byteorder == "big":
+        frames.byteswap()
+    with wave.open(path, "wb") as f:
+        f.setnchannels(2)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes(frames.tobytes())
+
+
+def generate_fixtures(directory, count, seconds):
+    os.makedirs(directory, exist_ok=True)
+    names = []
+    for index in range(count):
+        name = f"bench_{index:03d}_{seconds}s.wav"
+        path = os.path.join(directory, name)
+        if not os.path.exists(path):
+            write_tone(path, seconds, 220 * (index + 1))
+        names.append(name)
+
+        mp3_path = path[:-4] + ".mp3"
+        if not os.path.exists(mp3_path):
+            try:
+                subprocess.run([FFMPEG, "-v", "error", "-y", "-i", path, "-b:a", "128k", mp3_path],
+                               check=True, capture_output=True)
+            except (OSError, subprocess.CalledProcessError) as e:
+                print(f"MP3-фикстура не создана ({e}), в тесте будут только WAV")
+                continue
+        names.append(os.path.basename(mp3_path))
+    return names
+
+
+def parse_mix(text):
+    # "list:1,cut:4,exact:1" -> веса действий
+    mix = {}
+    for part in text.split(","):
+        action, _, weight = part.partition(":")
+        if action not in ("list", "cut", "exact"):
+            raise argparse.ArgumentTypeError(f"Неизвестное действие '{action}'")
+        mix[action] = float(weight or 1)
+    return mix
+
+
+class Worker(threading.Thread):
+    def __init__(self, address, files, mix, cut_seconds, deadline, requests, seed):
+        super().__init__(daemon=True)
+        self.client = AudioClient(*address)
+        self.files = files
+        self.actions, self.weights = zip(*mix.items())
+        self.cut_seconds = cut_seconds
+        self.deadline = deadline
+        self.requests = requests
+        self.random = random.Random(seed)
+        self.histograms = {action: LatencyHistogram() for action in self.actions}
+        self.errors = {action: 0 for action in self.actions}
+        self.bytes_received = 0
+        self.failure = None
+
+    def request(self, action):
+        if action == "list":
+            return {"action": "list"}
+        file, duration = self.random.choice(self.files)
+        length = min(self.cut_seconds, int(duration))
+        start = self.random.randint(0, max(0, int(duration) - length))
+        return {"action": "cut", "file": file, "start": start, "end": start + length, "exact": action == "exact"}
+
+    def receive(self, request_id):
+        # Возвращает True, если ответ на запрос завершился без ошибки
+        sink = Discard()
+        while True:
+            msg_type, response_id, length = recv_header(self.client.client_socket)
+            if msg_type == MSG_DATA:
+                self.client.receive_into(sink, length)
+            else:
+                sink.write(recv_exact(self.client.client_socket, length))
+            if response_id == request_id and msg_type != MSG_DATA:
+                self.bytes_received += sink.size
+                return msg_type != MSG_ERROR
+
+    def run(self):
+        try:
+            self.client.client_socket.connect(self.client.address)
+            done = 0
+            while time.monotonic() < self.deadline and (self.requests is None or done < self.requests):
+                action = self.random.choices(self.actions, self.weights)[0]
+                started = time.perf_counter()
+                request_id = self.client.send_command(self.request(action))
+                ok = self.receive(request_id)
+                self.histograms[action].record(time.perf_counter() - started)
+                if not ok:
+                    self.errors[action] += 1
+                done += 1
+        except (OSError, ConnectionError) as e:
+            self.failure = str(e)
+        finally:
+            self.client.client_socket.close()
+
+
+def server_stats(address):
+    client = AudioClient(*address)
+    try:
+        client.client_socket.connect(address)
+        response = client.fetch_stats()
+    except (OSError, ConnectionError):
+        return None
+    finally:
+        client.client_socket.close()
+    return response if "error" not in response else None
+
+
+def list_files(address):
+    client = AudioClient(*address)
+    client.client_socket.connect(address)
+    try:
+        response = client.fetch_files()
+    finally:
+        client.client_socket.close()
+    if not isinstance(response, list):
+        raise RuntimeError(f"Не удалось получить список файлов: {response}")
+    return [(file["name"], file["duration"]) for file in response]
+
+
+def spawn_server(args):
+    env = dict(os.environ, HOST=args.host, PORT=str(args.port), AUDIO_DIR=args.fixtures,
+               METADATA_FILE=os.path.join(args.fixtures, "metadata.json"),
+               SEGMENT_CACHE_DIR=os.path.join(args.fixtures, "segment_cache"),
+               PEAKS_DIR=os.path.join(args.fixtures, "peaks_cache"), WATCH_AUDIO_DIR="0")
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py")
+    process = subprocess.Popen([sys.executable, script, "--workers", str(args.workers)], env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(200):
+        try:
+            socket.create_connection((args.host, args.port), timeout=0.1).close()
+            return process
+        except OSError:
+            if process.poll() is not None:
+                raise RuntimeError("Сервер завершился при запуске")
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError("Сервер не начал принимать подключения")
+
+
+def run_benchmark(args):
+    address = (args.host, args.port)
+    files = [file for file in list_files(address) if file[0].startswith(args.file_prefix)]
+    if not files:
+        raise RuntimeError("На сервере нет файлов для теста")
+    before = server_stats(address)
+
+    deadline = time.monotonic() + (args.duration if args.requests is None else float("inf"))
+    workers = [Worker(address, files, args.mix, args.cut_seconds, deadline, args.requests, args.seed + index)
+               for index in range(args.connections)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+    after = server_stats(address)
+
+    results = {}
+    for action in args.mix:
+        histogram = LatencyHistogram()
+        for worker in workers:
+            histogram.merge(worker.histograms[action])
+        results[action] = dict(histogram.snapshot(), errors=sum(worker.errors[action] for worker in workers),
+                               throughput=round(histogram.count / elapsed, 2))
+
+    total = sum(result["count"] for result in results.values())
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "config": {"connections": args.connections, "duration": args.duration, "requests": args.requests,
+                   "mix": args.mix, "cut_seconds": args.cut_seconds, "files": len(files), "workers": args.workers},
+        "elapsed": round(elapsed, 3),
+        "requests": total,
+        "throughput": round(total / elapsed, 2),
+        "bytes_received": sum(worker.bytes_received for worker in workers),
+        "latency_ms": results,
+        "failures": [worker.failure for worker in workers if worker.failure],
+        "server_memory": after.get("memory") if after else None,
+        "server_stats_before": before,
+        "server_stats_after": after,
+    }
+
+
+def print_report(report):
+    print(f"Запросов: {report['requests']} за {report['elapsed']} сек ({report['throughput']} в сек), "
+          f"получено {report['bytes_received'] / 1024 / 1024:.1f} МБ")
+    print(f"{'действие':<8} {'число':>7} {'ошибки':>7} {'в сек':>8} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}")
+    for action, result in report["latency_ms"].items():
+        print(f"{action:<8} {result['count']:>7} {result['errors']:>7} {result['throughput']:>8} "
+              f"{result['p50']:>9.3f} {result['p95']:>9.3f} {result['p99']:>9.3f} {result['max']:>9.3f}")
+    memory = report["server_memory"] or {}
+    if memory:
+        print(f"Память сервера: RSS {memory.get('rss_bytes', 0) / 1024 / 1024:.1f} МБ, "
+              f"пик {memory.get('max_rss_bytes', 0) / 1024 / 1024:.1f} МБ")
+    for failure in report["failures"]:
+        print(f"Соединение прервано: {failure}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест аудиосервера")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--connections", type=int, default=8, help="число одновременных соединений")
+    parser.add_argument("--duration", type=float, default=10, help="длительность теста, сек")
+    parser.add_argument("--requests", type=int, help="число запросов на соединение вместо длительности")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("list:1,cut:4"),
+                        help="веса действий list/cut/exact, например 'list:1,cut:4,exact:1'")
+    parser.add_argument("--cut-seconds", type=int, default=10, help="длина вырезаемого отрезка, сек")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--fixtures", default=FIXTURES_DIR, help="каталог синтетических аудиофайлов")
+    parser.add_argument("--fixture-count", type=int, default=4)
+    parser.add_argument("--fixture-seconds", type=int, default=60)
+    parser.add_argument("--generate-only", action="store_true", help="только создать фикстуры")
+    parser.add_argument("--spawn", action="store_true", help="запустить сервер на фикстурах на время теста")
+    parser.add_argument("--workers", type=int, default=1, help="число процессов запускаемого сервера")
+    parser.add_argument("--output", help="файл для результатов в JSON")
+    args = parser.parse_args()
+
+    generated = generate_fixtures(args.fixtures, args.fixture_count, args.fixture_seconds)
+    if args.generate_only:
+        print(f"Фикстуры в '{args.fixtures}': {', '.join(generated)}")
+        return
+    # С чужим сервером тест идет по всем его файлам, с запущенным — только по фикстурам
+    args.file_prefix = "bench_" if args.spawn else ""
+
+    process = spawn_server(args) if args.spawn else None
+    try:
+        report = run_benchmark(args)
+    finally:
+        if process is not None:
+            # SIGINT, чтобы сервер с --workers сам остановил свои рабочие процессы
+            process.send_signal(signal.SIGINT)
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4, ensure_ascii=False)
+        print(f"Результаты сохранены в {args.output}")
+
+
+if __name__ == "__main__":
+    main()
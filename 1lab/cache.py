@@ -0,0 +1,56 @@
+import os
+import logging
+from collections import OrderedDict
+from pydub import AudioSegment
+
+
+class DecodedAudioCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, file_path):
+        mtime = os.stat(file_path).st_mtime_ns
+        entry = self.entries.get(file_path)
+        if entry is not None:
+            if entry[0] == mtime:
+                self.entries.move_to_end(file_path)
+                self.hits += 1
+                return entry[1]
+            self.invalidate(file_path)
+
+        self.misses += 1
+        audio = AudioSegment.from_file(file_path)
+        self.put(file_path, mtime, audio)
+        return audio
+
+    def put(self, file_path, mtime, audio):
+        size = len(audio.raw_data)
+        if size > self.max_bytes:
+            return
+        self.entries[file_path] = (mtime, audio, size)
+        self.current_bytes += size
+        while self.current_bytes > self.max_bytes:
+            evicted_path, (_, _, evicted_size) = self.entries.popitem(last=False)
+            self.current_bytes -= evicted_size
+            self.evictions += 1
+            logging.info(f"Декодированный файл '{evicted_path}' вытеснен из кэша")
+
+    def invalidate(self, file_path):
+        entry = self.entries.pop(file_path, None)
+        if entry is not None:
+            self.current_bytes -= entry[2]
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "bytes": self.current_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
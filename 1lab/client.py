@@ -1,37 +1,294 @@
 import socket
+import sys
 import json
 import os
+import queue
+import hashlib
+import threading
+from array import array
 from dotenv import load_dotenv
+from protocol import MSG_DATA, MSG_END, MSG_ERROR, MSG_JSON, MSG_REQUEST, pack_json, recv_exact, recv_frame, recv_header
 
 load_dotenv()
 HOST = os.getenv("HOST", "127.0.0.1")
 PORT = int(os.getenv("PORT", 65432))
+DOWNLOAD_CONNECTIONS = int(os.getenv("DOWNLOAD_CONNECTIONS", 4))
+DOWNLOAD_RETRIES = 3
+# Ответ сервера, который не поддерживает действие (асинхронный сервер не знает cut_info)
+UNKNOWN_ACTION_ERROR = "Неизвестное действие."
+
+
+def invalid_blocks(f, state):
+    # Номера блоков файла, SHA-256 которых не совпадает с перечисленными в cut_info
+    chunk_size = state["chunk_size"]
+    invalid = []
+    for index, digest in enumerate(state["sha256"]):
+        f.seek(index * chunk_size)
+        if hashlib.sha256(f.read(chunk_size)).hexdigest() != digest:
+            invalid.append(index)
+    return invalid
+
 
 class AudioClient:
     def __init__(self, host, port):
         self.address = (host, port)
         self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.next_request_id = 1
+        self.files = None
 
     def connect(self):
         self.client_socket.connect(self.address)
         print(f"Подключен к серверу {self.address[0]}:{self.address[1]}")
 
     def send_command(self, command):
-        self.client_socket.send(json.dumps(command).encode("utf-8"))
+        request_id = self.next_request_id
+        self.next_request_id += 1
+        self.client_socket.sendall(pack_json(MSG_REQUEST, request_id, command))
+        return request_id
 
     def receive_json_data(self):
-        data = b''
+        msg_type, _, payload = recv_frame(self.client_socket)
+        if msg_type not in (MSG_JSON, MSG_ERROR):
+            return {"error": "Неожиданный ответ от сервера."}
+        try:
+            return json.loads(payload.decode("utf-8"))
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            return {"error": "Ошибка обработки ответа от сервера."}
+
+    def receive_into(self, f, length):
+        while length:
+            chunk = self.client_socket.recv(min(length, 65536))
+            if not chunk:
+                raise ConnectionError("Соединение закрыто")
+            f.write(chunk)
+            length -= len(chunk)
+
+    def fetch_files(self):
+        self.send_command({"action": "list"})
+        response = self.receive_json_data()
+        if isinstance(response, list):
+            self.files = {file["name"]: file["duration"] for file in response}
+        return response
+
+    def query_files(self, **filters):
+        # Фильтры: prefix, format, min_duration, max_duration, offset, limit
+        self.send_command(dict(filters, action="list"))
+        return self.receive_json_data()
+
+    def fetch_stats(self):
+        self.send_command({"action": "stats"})
+        return self.receive_json_data()
+
+    def fetch_peaks(self, file, start=None, end=None, points=None):
+        # Возвращает (описание, список пар (минимум, максимум)) либо ответ с ошибкой
+        command = {"action": "peaks", "file": file, "start": start, "end": end, "points": points}
+        request_id = self.send_command({key: value for key, value in command.items() if value is not None})
+        meta = None
+        peaks = array("h")
         while True:
-            data += self.client_socket.recv(100)
+            msg_type, response_id, length = recv_header(self.client_socket)
+            payload = recv_exact(self.client_socket, length)
+            if response_id != request_id:
+                continue
+            if msg_type == MSG_END:
+                if sys.byteorder == "big":
+                    peaks.byteswap()
+                return meta, list(zip(peaks[::2], peaks[1::2]))
+            if msg_type == MSG_DATA:
+                peaks.frombytes(payload)
+                continue
+            response = json.loads(payload.decode("utf-8"))
+            if msg_type == MSG_ERROR:
+                return response, None
+            meta = response
+
+    def fetch_cut_info(self, file, start, end, exact=False, output=None):
+        # output: необязательные параметры перекодирования format, bitrate, sample_rate
+        self.send_command(dict(output or {}, action="cut_info", file=file, start=start, end=end, exact=exact))
+        return self.receive_json_data()
+
+    def fetch_range(self, file, start, end, exact, version, offset, length, output=None):
+        # Возвращает (байты диапазона, None) или (None, текст ошибки)
+        self.send_command(dict(output or {}, action="cut", file=file, start=start, end=end, exact=exact,
+                               range=[offset, length], version=version))
+        data = bytearray()
+        while True:
+            msg_type, _, size = recv_header(self.client_socket)
+            payload = recv_exact(self.client_socket, size)
+            if msg_type == MSG_DATA:
+                data += payload
+            elif msg_type == MSG_END:
+                return bytes(data), None
+            elif msg_type == MSG_ERROR:
+                return None, json.loads(payload.decode("utf-8"))["error"]
+            else:
+                return None, "Неожиданный ответ от сервера."
+
+    def download_cut(self, file, start, end, filename, exact=False, connections=DOWNLOAD_CONNECTIONS, output=None):
+        # Результат качается блоками по нескольким соединениям в файл .part; каждый блок сверяется с SHA-256
+        # из cut_info. Уже скачанные и совпавшие блоки при повторном запуске не запрашиваются
+        output = output or {}
+        info = self.fetch_cut_info(file, start, end, exact, output)
+        if info.get("error") == UNKNOWN_ACTION_ERROR:
+            return self.stream_cut(file, start, end, filename, exact, output)
+        if "error" in info:
+            return info["error"]
+        state = {"file": file, "start": start, "end": end, "exact": exact, "output": output,
+                 "version": info["version"], "size": info["size"], "chunk_size": info["chunk_size"],
+                 "sha256": info["sha256"]}
+        part_path = f"{filename}.part"
+        state_path = f"{filename}.part.json"
+        try:
+            with open(state_path, "r", encoding="utf-8") as f:
+                resumable = json.load(f) == state
+        except (OSError, ValueError):
+            resumable = False
+        chunk_size = state["chunk_size"]
+
+        with open(part_path, "r+b" if resumable and os.path.exists(part_path) else "w+b") as f:
+            f.truncate(state["size"])
+            missing = queue.Queue()
+            for index in invalid_blocks(f, state):
+                missing.put(index)
+        with open(state_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+
+        errors = []
+        lock = threading.Lock()
+
+        def worker():
+            client = AudioClient(*self.address)
             try:
-                return json.loads(data.decode("utf-8"))
-            except (UnicodeDecodeError, json.JSONDecodeError):
-                pass
-                # return {"error": "Ошибка обработки ответа от сервера."}
+                client.client_socket.connect(self.address)
+                with open(part_path, "r+b") as f:
+                    while True:
+                        try:
+                            index = missing.get_nowait()
+                        except queue.Empty:
+                            return
+                        offset = index * chunk_size
+                        length = min(chunk_size, state["size"] - offset)
+                        for _ in range(DOWNLOAD_RETRIES):
+                            data, error = client.fetch_range(file, start, end, exact, state["version"], offset, length,
+                                                             output)
+                            if data is not None and hashlib.sha256(data).hexdigest() == state["sha256"][index]:
+                                f.seek(offset)
+                                f.write(data)
+                                break
+                            error = error or f"Контрольная сумма блока {index} не совпала"
+                        else:
+                            with lock:
+                                errors.append(error)
+                            return
+            except Exception as e:
+                # Любая ошибка (в том числе ProtocolError и ValueError из ответа) должна попасть в errors:
+                # взятый из очереди блок иначе потеряется, и незаконченный файл будет принят за целый
+                with lock:
+                    errors.append(str(e) or type(e).__name__)
+            finally:
+                client.client_socket.close()
+
+        workers = [threading.Thread(target=worker) for _ in range(max(1, min(connections, missing.qsize())))]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        if errors or not missing.empty():
+            return errors[0] if errors else "Загрузка не завершена."
+        # Перед переименованием каждый блок файла сверяется еще раз
+        with open(part_path, "rb") as f:
+            invalid = invalid_blocks(f, state)
+        if invalid:
+            return f"Контрольная сумма блока {invalid[0]} не совпала"
+        os.replace(part_path, filename)
+        os.unlink(state_path)
+        return None
+
+    def stream_cut(self, file, start, end, filename, exact=False, output=None):
+        # Весь результат одним ответом, без проверки блоков и докачки; возвращает текст ошибки или None
+        request_id = self.send_command(dict(output or {}, action="cut", file=file, start=start, end=end, exact=exact))
+        part_path = f"{filename}.part"
+        with open(part_path, "wb") as f:
+            while True:
+                msg_type, response_id, length = recv_header(self.client_socket)
+                if msg_type == MSG_DATA and response_id == request_id:
+                    self.receive_into(f, length)
+                    continue
+                payload = recv_exact(self.client_socket, length)
+                if response_id == request_id:
+                    break
+        if msg_type == MSG_END:
+            os.replace(part_path, filename)
+            return None
+        os.unlink(part_path)
+        if msg_type == MSG_ERROR:
+            return json.loads(payload.decode("utf-8"))["error"]
+        return "Неожиданный ответ от сервера."
+
+    def pipeline_cuts(self, cuts, exact=False):
+        # Все запросы отправляются сразу, ответы разбираются по id запроса в порядке прихода
+        pending = {}
+        for file, start, end, filename in cuts:
+            command = {"action": "cut", "file": file, "start": start, "end": end, "exact": exact}
+            pending[self.send_command(command)] = filename
+
+        errors = {}
+        handles = {}
+        try:
+            while pending:
+                msg_type, request_id, length = recv_header(self.client_socket)
+                filename = pending.get(request_id)
+                if msg_type == MSG_DATA and filename is not None:
+                    if request_id not in handles:
+                        handles[request_id] = open(filename, "wb")
+                    self.receive_into(handles[request_id], length)
+                    continue
+                payload = recv_exact(self.client_socket, length)
+                if filename is None:
+                    continue
+                if msg_type == MSG_ERROR:
+                    errors[filename] = json.loads(payload.decode("utf-8"))["error"]
+                elif msg_type != MSG_END:
+                    errors[filename] = "Неожиданный ответ от сервера."
+                if request_id in handles:
+                    handles.pop(request_id).close()
+                del pending[request_id]
+        finally:
+            for handle in handles.values():
+                handle.close()
+        return errors
+
+    def batch_cut(self, items, exact=False):
+        # items: список (файл, начало, конец); результат: список (имя сохраненного файла или None, ошибка)
+        request_id = self.send_command({
+            "action": "batch_cut",
+            "items": [{"file": file, "start": start, "end": end} for file, start, end in items],
+            "exact": exact,
+        })
+        results = [(None, "Ответ не получен.")] * len(items)
+        while True:
+            msg_type, response_id, length = recv_header(self.client_socket)
+            if response_id != request_id:
+                recv_exact(self.client_socket, length)
+                continue
+            if msg_type == MSG_END:
+                return results
+            if msg_type in (MSG_JSON, MSG_ERROR):
+                meta = json.loads(recv_exact(self.client_socket, length).decode("utf-8"))
+                if "index" not in meta:
+                    return [(None, meta.get("error", "Неожиданный ответ от сервера."))] * len(items)
+                index = meta["index"]
+                if msg_type == MSG_ERROR:
+                    results[index] = (None, meta["error"])
+                continue
+            file, start, end = items[index]
+            filename = f"cut_{start}-{end}_{file}"
+            with open(filename, "wb") as f:
+                self.receive_into(f, length)
+            results[index] = (filename, None)
 
     def list_files(self):
-        self.send_command({"action": "list"})
-        response = self.receive_json_data()
+        response = self.fetch_files()
 
         if "error" in response:
             print(f"Ошибка: {response['error']}")
@@ -44,17 +301,39 @@ class AudioClient:
             else:
                 print("Нет доступных файлов.")
 
-    def cut_audio(self):
-        self.send_command({"action": "list"})
-        files_data = self.receive_json_data()
-
-        if "error" in files_data:
-            print(f"Ошибка: {files_data['error']}")
+    def show_stats(self):
+        response = self.fetch_stats()
+        if "error" in response:
+            print(f"Ошибка: {response['error']}")
             return
+        print(json.dumps(response, ensure_ascii=False, indent=2))
 
-        available_files = {file["name"]: file["duration"] for file in files_data}
+    def show_peaks(self):
+        file = input("Имя файла: ").strip()
+        try:
+            points = int(input("Число точек: ") or 80)
+        except ValueError:
+            print("Ошибка: Число точек должно быть целым.")
+            return
+        meta, peaks = self.fetch_peaks(file, points=points)
+        if peaks is None:
+            print(f"Ошибка: {meta['error']}")
+            return
+        # Грубая текстовая осциллограмма: высота столбца пропорциональна размаху
+        print(f"{meta['file']}: {meta['start']}-{meta['end']} сек, точек: {meta['points']}")
+        print("".join(" ▁▂▃▄▅▆▇█"[min(8, (high - low) * 9 // 65536)] for low, high in peaks))
 
+    def cut_audio(self):
         file = input("Имя файла: ").strip()
+        # Сохраненный список запрашивается заново, если файла в нем нет: каталог на сервере мог измениться.
+        # Удаленный с тех пор файл здесь еще пройдет проверку, его отклонит сервер
+        if self.files is None or file not in self.files:
+            files_data = self.fetch_files()
+            if "error" in files_data:
+                print(f"Ошибка: {files_data['error']}")
+                return
+
+        available_files = self.files
         if file not in available_files:
             print(f"Ошибка: Файл '{file}' не найден. Доступные файлы: {', '.join(available_files.keys())}")
             return
@@ -81,43 +360,66 @@ class AudioClient:
             print("Ошибка: Начальное время не может быть больше или равно конечному.")
             return
 
-        self.send_command({"action": "cut", "file": file, "start": start, "end": end})
-        first_chunk = self.client_socket.recv(4096)
-
+        output = {}
+        file_format = input("Формат (mp3/wav/ogg/flac, пусто - как у исходного): ").strip().lower()
+        if file_format:
+            output["format"] = file_format
         try:
-            decoded = first_chunk.decode("utf-8")
-            if decoded.startswith('{"error"'):
-                error_msg = json.loads(decoded)["error"]
-                print("Ошибка:", error_msg)
-                return
-        except UnicodeDecodeError:
-            pass
+            bitrate = input("Битрейт, кбит/с (пусто - по умолчанию): ").strip()
+            sample_rate = input("Частота дискретизации, Гц (пусто - как у исходного): ").strip()
+            if bitrate:
+                output["bitrate"] = int(bitrate)
+            if sample_rate:
+                output["sample_rate"] = int(sample_rate)
+        except ValueError:
+            print("Ошибка: Битрейт и частота должны быть целыми числами.")
+            return
+
+        filename = f"cut_{os.path.splitext(file)[0]}.{file_format or file.split('.')[-1]}"
+        error = self.download_cut(file, start, end, filename, output=output)
+        if error:
+            print("Ошибка:", error)
+            print("Повторите команду, чтобы продолжить загрузку с места остановки.")
+            return
 
-        filename = f"cut_{file}"
-        with open(filename, "wb") as f:
-            f.write(first_chunk)
-            self.client_socket.settimeout(1.0)
-            try:
-                while True:
-                    chunk = self.client_socket.recv(4096)
-                    if not chunk:
-                        break
-                    f.write(chunk)
-            except socket.timeout:
-                pass
-
-        self.client_socket.settimeout(None)
         print(f"Аудио отрезок сохранен как {filename}")
 
+    def batch_audio(self):
+        print("Вводите отрезки в формате 'файл начало конец', пустая строка завершает ввод.")
+        items = []
+        while True:
+            line = input("> ").strip()
+            if not line:
+                break
+            parts = line.rsplit(maxsplit=2)
+            try:
+                items.append((parts[0], int(parts[1]), int(parts[2])))
+            except (IndexError, ValueError):
+                print("Ошибка: Ожидается 'файл начало конец' с целыми значениями времени.")
+        if not items:
+            return
+
+        for (file, start, end), (filename, error) in zip(items, self.batch_cut(items)):
+            if error:
+                print(f"Ошибка ({file} {start}-{end}): {error}")
+            else:
+                print(f"Аудио отрезок сохранен как {filename}")
+
     def run(self):
         self.connect()
         try:
             while True:
-                cmd = input("Введите команду (list/cut/exit): ").strip().lower()
+                cmd = input("Введите команду (list/cut/batch/peaks/stats/exit): ").strip().lower()
                 if cmd == "list":
                     self.list_files()
                 elif cmd == "cut":
                     self.cut_audio()
+                elif cmd == "batch":
+                    self.batch_audio()
+                elif cmd == "peaks":
+                    self.show_peaks()
+                elif cmd == "stats":
+                    self.show_stats()
                 elif cmd == "exit":
                     break
                 else:
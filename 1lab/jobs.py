@@ -0,0 +1,152 @@
+import os
+import time
+import hashlib
+import logging
+import tempfile
+from dotenv import load_dotenv
+from audio_format import AudioFormatError, cut_ranges
+from cache import DecodedAudioCache
+from peaks import compute_peaks, save_peaks, segment_samples, wav_peaks
+
+# Задачи, выполняемые в пуле процессов. Каждая возвращает план отправки:
+# (префикс, путь к файлу, смещение, длина, удалить ли файл после отправки)
+# Вместе с планами возвращается время этапов (в секундах), из которого сервер строит статистику
+
+load_dotenv()
+DECODE_CACHE_MB = int(os.getenv("DECODE_CACHE_MB", 512))
+
+_decoded_cache = None
+_decoded_cache_bytes = DECODE_CACHE_MB * 1024 * 1024
+
+
+def init_worker(processes):
+    # У каждого процесса пула свой кэш, поэтому бюджет DECODE_CACHE_MB делится между всеми процессами
+    global _decoded_cache_bytes
+    _decoded_cache_bytes = DECODE_CACHE_MB * 1024 * 1024 // max(1, processes)
+
+
+def decoded_cache():
+    global _decoded_cache
+    if _decoded_cache is None:
+        _decoded_cache = DecodedAudioCache(_decoded_cache_bytes)
+    return _decoded_cache
+
+
+def cache_timings(timings):
+    # Счетчики кэша этого процесса возвращаются вместе со временем этапов; сервер собирает их по pid
+    if _decoded_cache is not None:
+        timings["decode_cache"] = dict(_decoded_cache.stats(), pid=os.getpid())
+    return timings
+
+
+def exact_cut(file_path, start, end, output_path=None, timings=None, options=None):
+    # options: format, bitrate (кбит/с) и sample_rate результата, если он отличается от исходного файла
+    timings = {} if timings is None else timings
+    options = options or {}
+    started = time.perf_counter()
+    audio = decoded_cache().get(file_path)
+    segment = audio[start * 1000:end * 1000]
+    file_format = options.get("format") or file_path.split('.')[-1]
+    decoded = time.perf_counter()
+    timings["decode"] = timings.get("decode", 0) + decoded - started
+
+    if options.get("sample_rate"):
+        segment = segment.set_frame_rate(options["sample_rate"])
+    export_options = {"format": file_format}
+    if options.get("bitrate"):
+        export_options["bitrate"] = f"{options['bitrate']}k"
+    try:
+        if output_path is not None:
+            # Пишем во временный файл рядом и атомарно переименовываем, чтобы кэш не видел недописанный отрезок
+            temp_path = f"{output_path}.{os.getpid()}.tmp"
+            segment.export(temp_path, **export_options)
+            os.replace(temp_path, output_path)
+            return b"", output_path, 0, os.path.getsize(output_path), False
+
+        with tempfile.NamedTemporaryFile(delete=False, suffix=f".{file_format}") as temp_file:
+            temp_file.close()
+            segment.export(temp_file.name, **export_options)
+        return b"", temp_file.name, 0, os.path.getsize(temp_file.name), True
+    finally:
+        timings["export"] = timings.get("export", 0) + time.perf_counter() - decoded
+
+
+def cut_job(file_path, ranges, exact=False, output_paths=None, options=None):
+    # Возвращает (планы, время этапов); план равен None, если интервал обработать не удалось.
+    # Перекодирование (options) возможно только через декодирование
+    output_paths = output_paths or [None] * len(ranges)
+    timings = {}
+    plans = None
+    if not exact and not options:
+        started = time.perf_counter()
+        try:
+            plans = [(prefix, file_path, offset, length, False)
+                     for prefix, offset, length in cut_ranges(file_path, ranges)]
+        except (AudioFormatError, OSError) as e:
+            logging.warning(f"Копирование кадров '{file_path}' недоступно ({e}), перекодирование")
+        timings["scan"] = time.perf_counter() - started
+    if plans is not None:
+        return plans, cache_timings(timings)
+
+    results = []
+    for (start, end), output_path in zip(ranges, output_paths):
+        try:
+            results.append(exact_cut(file_path, start, end, output_path, timings, options))
+        except Exception as e:
+            logging.error(f"Не удалось обрезать '{file_path}' ({start}-{end} сек): {e}")
+            results.append(None)
+    return results, cache_timings(timings)
+
+
+def peaks_job(file_path, output_path):
+    # Строит индекс пиков файла; возвращает (число пар, время этапов)
+    timings = {}
+    started = time.perf_counter()
+    try:
+        peaks = wav_peaks(file_path)
+    except (AudioFormatError, OSError, ValueError):
+        samples, sample_rate = segment_samples(decoded_cache().get(file_path))
+        decoded = time.perf_counter()
+        timings["decode"] = decoded - started
+        started = decoded
+        peaks = compute_peaks(samples, sample_rate)
+    save_peaks(peaks, output_path)
+    timings["peaks"] = time.perf_counter() - started
+    return len(peaks), cache_timings(timings)
+
+
+def plan_digests(plan, chunk_size):
+    # SHA-256 каждого блока результата (префикс + диапазон файла) для проверки загрузки по частям
+    prefix, path, offset, length, _ = plan
+    digests = []
+    pending = bytearray(prefix)
+    with open(path, "rb") as f:
+        f.seek(offset)
+        while length or pending:
+            while length and len(pending) < chunk_size:
+                data = f.read(min(length, chunk_size - len(pending)))
+                if not data:
+                    raise OSError(f"Файл '{path}' оказался короче ожидаемого")
+                pending += data
+                length -= len(data)
+            digests.append(hashlib.sha256(pending[:chunk_size]).hexdigest())
+            del pending[:chunk_size]
+    return digests
+
+
+def cut_info_job(file_path, start, end, exact, output_path, chunk_size, plan=None, options=None):
+    # Возвращает ((размер, хеши блоков) или None, время этапов); готовый план (из кэша) не пересчитывается
+    timings = {}
+    if plan is None:
+        plans, timings = cut_job(file_path, [(start, end)], exact, [output_path], options)
+        plan = plans[0]
+    if plan is None:
+        return None, timings
+    started = time.perf_counter()
+    try:
+        digests = plan_digests(plan, chunk_size)
+    finally:
+        if plan[4]:
+            os.unlink(plan[1])
+    timings["hash"] = time.perf_counter() - started
+    return (len(plan[0]) + plan[3], digests), cache_timings(timings)
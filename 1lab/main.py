@@ -1,6 +1,7 @@
 import os
 from dotenv import load_dotenv
 from server import AudioServer
+from async_server import AsyncAudioServer
 from client import AudioClient
 
 load_dotenv()
@@ -9,12 +10,15 @@ HOST = os.getenv("HOST", "127.0.0.1")
 PORT = int(os.getenv("PORT", 8888))
 
 if __name__ == '__main__':
-    mode = input("Запустить сервер или клиент? (server/client): ")
+    mode = input("Запустить сервер или клиент? (server/async/client): ")
     if mode == "server":
         server = AudioServer(host=HOST, port=PORT)
         server.run()
+    elif mode == "async":
+        server = AsyncAudioServer(host=HOST, port=PORT)
+        server.run()
     elif mode == "client":
         client = AudioClient(host=HOST, port=PORT)
         client.run()
     else:
-        print("Ошибка! Укажите server/client!")
+        print("Ошибка! Укажите server/async/client!")
@@ -0,0 +1,133 @@
+import os
+import json
+import logging
+from pydub import AudioSegment
+from audio_format import AudioFormatError, probe_duration
+
+AUDIO_EXTENSIONS = (".mp3", ".wav")
+LIST_FILTERS = ("prefix", "format", "min_duration", "max_duration", "offset", "limit")
+MAX_LIST_LIMIT = 1000
+
+
+class MetadataIndex:
+    def __init__(self, audio_dir, metadata_file):
+        self.audio_dir = audio_dir
+        self.metadata_file = metadata_file
+        self.entries = {}
+        self.sorted_entries = []
+        self.snapshot = b"[]"
+
+    def load(self):
+        try:
+            with open(self.metadata_file, 'r', encoding='utf-8') as f:
+                stored = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            stored = []
+        self.entries = {
+            entry["name"]: entry for entry in stored
+            if isinstance(entry, dict) and "name" in entry and "size" in entry and "mtime" in entry
+        }
+        self.publish()
+
+    def probe(self, file_path):
+        try:
+            return probe_duration(file_path)
+        except AudioFormatError as e:
+            logging.warning(f"Не удалось прочитать заголовок '{file_path}' ({e}), файл будет декодирован")
+            return len(AudioSegment.from_file(file_path)) / 1000
+
+    def scan(self, names=None):
+        files = {}
+        for file in os.listdir(self.audio_dir) if names is None else names:
+            if file.endswith(AUDIO_EXTENSIONS):
+                try:
+                    files[file] = os.stat(os.path.join(self.audio_dir, file))
+                except FileNotFoundError:
+                    pass
+        return files
+
+    def collect(self, names=None):
+        # Чтение каталога и определение длительностей без изменения индекса, поэтому может выполняться
+        # в отдельном потоке; результат применяется через apply в потоке, который владеет индексом.
+        # names ограничивает проверку указанными файлами (например, по событиям наблюдателя)
+        files = self.scan(names)
+        known = list(self.entries) if names is None else [name for name in names if name in self.entries]
+        removed = [file for file in known if file not in files]
+        updated = {}
+        for file, stat in files.items():
+            entry = self.entries.get(file)
+            if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime_ns:
+                continue
+            try:
+                duration = self.probe(os.path.join(self.audio_dir, file))
+            except Exception as e:
+                logging.error(f"Не удалось получить длительность '{file}': {e}")
+                removed.append(file)
+                continue
+            updated[file] = {
+                "name": file,
+                "duration": round(duration, 3),
+                "format": file.split('.')[-1],
+                "size": stat.st_size,
+                "mtime": stat.st_mtime_ns,
+            }
+        return removed, updated
+
+    def apply(self, removed, updated):
+        changed = {file for file in removed if self.entries.pop(file, None) is not None}
+        self.entries.update(updated)
+        changed.update(updated)
+        if changed:
+            self.publish()
+        if changed or not os.path.exists(self.metadata_file):
+            self.save()
+        return changed
+
+    def refresh(self, names=None):
+        return self.apply(*self.collect(names))
+
+    def publish(self):
+        # Список и его JSON пересобираются целиком и подменяются одним присваиванием
+        sorted_entries = self.to_list()
+        snapshot = json.dumps(sorted_entries, ensure_ascii=False).encode("utf-8")
+        self.sorted_entries, self.snapshot = sorted_entries, snapshot
+
+    def list_payload(self, command):
+        if not any(key in command for key in LIST_FILTERS):
+            return self.snapshot
+
+        prefix = command.get("prefix")
+        file_format = command.get("format")
+        if not all(value is None or isinstance(value, str) for value in (prefix, file_format)):
+            raise ValueError("Параметры prefix и format должны быть строками.")
+        try:
+            min_duration = float(command["min_duration"]) if command.get("min_duration") is not None else None
+            max_duration = float(command["max_duration"]) if command.get("max_duration") is not None else None
+            offset = int(command.get("offset") or 0)
+            limit = int(command["limit"]) if command.get("limit") is not None else MAX_LIST_LIMIT
+        except (TypeError, ValueError, OverflowError):
+            raise ValueError("Параметры фильтра должны быть числами.")
+        if offset < 0 or not 0 < limit <= MAX_LIST_LIMIT:
+            raise ValueError(f"Смещение не может быть отрицательным, а лимит должен быть от 1 до {MAX_LIST_LIMIT}.")
+
+        files = [
+            entry for entry in self.sorted_entries
+            if (not prefix or entry["name"].startswith(prefix))
+            and (not file_format or entry["format"] == file_format)
+            and (min_duration is None or entry["duration"] >= min_duration)
+            and (max_duration is None or entry["duration"] <= max_duration)
+        ]
+        response = {"files": files[offset:offset + limit], "total": len(files), "offset": offset, "limit": limit}
+        return json.dumps(response, ensure_ascii=False).encode("utf-8")
+
+    def get(self, file):
+        return self.entries.get(file)
+
+    def to_list(self):
+        return [self.entries[file] for file in sorted(self.entries)]
+
+    def save(self):
+        temp_path = f"{self.metadata_file}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_list(), f, indent=4, ensure_ascii=False)
+        os.replace(temp_path, self.metadata_file)
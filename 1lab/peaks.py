@@ -0,0 +1,102 @@
+import os
+import logging
+import numpy as np
+from audio_format import AudioFormatError, map_file, parse_wav
+from segment_cache import source_prefix
+
+# Индекс пиков: для каждых 1/PEAKS_RATE секунды хранится пара (минимум, максимум) по всем каналам в шкале int16.
+# Массив формы (N, 2) сохраняется в .npy и читается через mmap без загрузки в память
+PEAKS_RATE = 100
+WAV_FORMAT_PCM = 1
+
+
+def wav_peaks(file_path, rate=PEAKS_RATE):
+    # Несжатый 16-битный WAV читается прямо из отображенного файла, без декодирования.
+    # Отображение закрывается здесь же, поэтому ссылки на его память (samples) не должны пережить функцию
+    data = map_file(file_path)
+    samples = None
+    try:
+        info = parse_wav(data)
+        if int.from_bytes(info["fmt"][:2], "little") != WAV_FORMAT_PCM or info["bits"] != 16:
+            raise AudioFormatError("Поддерживается только 16-битный PCM")
+        count = info["data_size"] // 2
+        samples = np.frombuffer(data, dtype="<i2", count=count, offset=info["data_offset"])
+        return compute_peaks(samples.reshape(-1, info["channels"]), info["sample_rate"], rate)
+    finally:
+        samples = None
+        data.close()
+
+
+def segment_samples(audio):
+    width = audio.sample_width
+    if width == 1:
+        samples = (np.frombuffer(audio.raw_data, dtype=np.uint8).astype(np.int16) - 128) << 8
+    elif width == 2:
+        samples = np.frombuffer(audio.raw_data, dtype="<i2")
+    elif width == 4:
+        samples = (np.frombuffer(audio.raw_data, dtype="<i4") >> 16).astype(np.int16)
+    else:
+        raise AudioFormatError(f"Неподдерживаемая разрядность: {width * 8} бит")
+    return samples.reshape(-1, audio.channels), audio.frame_rate
+
+
+def reduce_peaks(lows, highs, buckets):
+    # Сворачивает ряды в buckets групп почти равной длины: минимум минимумов и максимум максимумов
+    bounds = np.linspace(0, len(lows), buckets, endpoint=False).astype(np.int64)
+    return np.minimum.reduceat(lows, bounds), np.maximum.reduceat(highs, bounds)
+
+
+def compute_peaks(samples, sample_rate, rate=PEAKS_RATE):
+    if not len(samples) or not sample_rate:
+        return np.zeros((0, 2), dtype=np.int16)
+    lows = samples.min(axis=1)
+    highs = samples.max(axis=1)
+    buckets = max(1, int(np.ceil(len(samples) * rate / sample_rate)))
+    bounds = (np.arange(buckets, dtype=np.int64) * sample_rate) // rate
+    return np.stack([np.minimum.reduceat(lows, bounds), np.maximum.reduceat(highs, bounds)], axis=1)
+
+
+def save_peaks(peaks, output_path):
+    temp_path = f"{output_path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        np.save(f, peaks)
+    os.replace(temp_path, output_path)
+
+
+def load_peaks(path):
+    return np.load(path, mmap_mode="r")
+
+
+def peaks_range(peaks, start, end, points, rate=PEAKS_RATE):
+    # Пики интервала [start, end) секунд, сведенные не более чем к points парам
+    first = min(int(start * rate), len(peaks))
+    last = min(max(int(np.ceil(end * rate)), first), len(peaks))
+    window = peaks[first:last]
+    if len(window) <= points:
+        return np.array(window, dtype=np.int16)
+    lows, highs = reduce_peaks(window[:, 0], window[:, 1], points)
+    return np.stack([lows, highs], axis=1)
+
+
+class PeaksStore:
+    def __init__(self, directory):
+        self.directory = directory
+
+    def load(self):
+        os.makedirs(self.directory, exist_ok=True)
+        for name in os.listdir(self.directory):
+            if name.endswith(".tmp"):
+                os.unlink(os.path.join(self.directory, name))
+
+    def path(self, file, mtime):
+        return os.path.join(self.directory, f"{source_prefix(file)}-{mtime}-{PEAKS_RATE}.npy")
+
+    def invalidate(self, file, current_mtime=None):
+        prefix = f"{source_prefix(file)}-"
+        current = f"{prefix}{current_mtime}-"
+        for name in os.listdir(self.directory):
+            if name.startswith(prefix) and not name.startswith(current):
+                try:
+                    os.unlink(os.path.join(self.directory, name))
+                except OSError as e:
+                    logging.warning(f"Не удалось удалить индекс пиков '{name}': {e}")
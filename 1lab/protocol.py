@@ -0,0 +1,95 @@
+import json
+import struct
+
+# Заголовок кадра: магия, версия, тип, id запроса, длина полезной нагрузки
+MAGIC = b"AU"
+VERSION = 1
+HEADER = struct.Struct("!2sBBIQ")
+HEADER_SIZE = HEADER.size
+MAX_PAYLOAD = 64 * 1024 * 1024
+
+MSG_REQUEST = 1
+MSG_JSON = 2
+MSG_DATA = 3
+MSG_END = 4
+MSG_ERROR = 5
+
+MESSAGE_TYPES = {MSG_REQUEST, MSG_JSON, MSG_DATA, MSG_END, MSG_ERROR}
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def pack_header(msg_type, request_id, length):
+    return HEADER.pack(MAGIC, VERSION, msg_type, request_id, length)
+
+
+def pack_frame(msg_type, request_id, payload=b""):
+    return pack_header(msg_type, request_id, len(payload)) + payload
+
+
+def pack_json(msg_type, request_id, obj):
+    return pack_frame(msg_type, request_id, json.dumps(obj, ensure_ascii=False).encode("utf-8"))
+
+
+def unpack_header(data):
+    magic, version, msg_type, request_id, length = HEADER.unpack(data)
+    if magic != MAGIC:
+        raise ProtocolError("Неверная сигнатура кадра")
+    if version != VERSION:
+        raise ProtocolError(f"Неподдерживаемая версия протокола: {version}")
+    if msg_type not in MESSAGE_TYPES:
+        raise ProtocolError(f"Неизвестный тип кадра: {msg_type}")
+    return msg_type, request_id, length
+
+
+# Инкрементальный разбор кадров из потока байтов
+class FrameDecoder:
+    def __init__(self, max_payload=MAX_PAYLOAD):
+        self.buffer = bytearray()
+        self.max_payload = max_payload
+
+    def append(self, data):
+        self.buffer += data
+
+    def next_frame(self):
+        # Следующий полный кадр или None; недочитанные данные остаются в буфере
+        if len(self.buffer) < HEADER_SIZE:
+            return None
+        msg_type, request_id, length = unpack_header(bytes(self.buffer[:HEADER_SIZE]))
+        if length > self.max_payload:
+            raise ProtocolError(f"Слишком большой кадр: {length} байт")
+        if len(self.buffer) < HEADER_SIZE + length:
+            return None
+        payload = bytes(self.buffer[HEADER_SIZE:HEADER_SIZE + length])
+        del self.buffer[:HEADER_SIZE + length]
+        return msg_type, request_id, payload
+
+    def feed(self, data):
+        self.append(data)
+        frames = []
+        frame = self.next_frame()
+        while frame is not None:
+            frames.append(frame)
+            frame = self.next_frame()
+        return frames
+
+
+def recv_exact(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(min(size - len(data), 65536))
+        if not chunk:
+            raise ConnectionError("Соединение закрыто")
+        data += chunk
+    return bytes(data)
+
+
+def recv_header(sock):
+    return unpack_header(recv_exact(sock, HEADER_SIZE))
+
+
+def recv_frame(sock):
+    msg_type, request_id, length = recv_header(sock)
+    return msg_type, request_id, recv_exact(sock, length)
@@ -0,0 +1,110 @@
+import os
+import json
+import hashlib
+import logging
+from collections import OrderedDict
+
+
+def source_prefix(file):
+    # Общий префикс имен производных файлов (отрезков, пиков), по которому они удаляются при изменении источника
+    return hashlib.sha1(file.encode("utf-8")).hexdigest()[:16]
+
+
+class SegmentCache:
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.temp_counter = 0
+
+    def load(self):
+        os.makedirs(self.directory, exist_ok=True)
+        files = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith(".tmp"):
+                os.unlink(path)
+                continue
+            stat = os.stat(path)
+            files.append((stat.st_mtime_ns, name, stat.st_size))
+        # Порядок LRU восстанавливается по времени последнего обращения (mtime файла)
+        for _, name, size in sorted(files):
+            self.entries[name] = size
+            self.current_bytes += size
+        self.evict()
+
+    def entry_name(self, file, mtime, start, end, file_format, **options):
+        params = json.dumps([start, end, file_format, options], sort_keys=True)
+        digest = hashlib.sha256(params.encode("utf-8")).hexdigest()[:24]
+        return f"{source_prefix(file)}-{mtime}-{digest}.{file_format}"
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def get(self, name):
+        if name in self.entries:
+            self.entries.move_to_end(name)
+            try:
+                os.utime(self.path(name))
+            except FileNotFoundError:
+                self.discard(name)
+            else:
+                self.hits += 1
+                return self.path(name)
+        self.misses += 1
+        return None
+
+    def add(self, name):
+        # Отрезок больше всего кэша не сохраняется: иначе он был бы вытеснен сразу после записи, до отправки.
+        # Такой файл переименовывается во временный и возвращается его путь, иначе - None
+        size = os.path.getsize(self.path(name))
+        if size > self.max_bytes:
+            if name in self.entries:
+                self.current_bytes -= self.entries.pop(name)
+            self.temp_counter += 1
+            temp_path = f"{self.path(name)}.{os.getpid()}.{self.temp_counter}.tmp"
+            os.replace(self.path(name), temp_path)
+            return temp_path
+        if name in self.entries:
+            self.current_bytes -= self.entries[name]
+        self.entries[name] = size
+        self.entries.move_to_end(name)
+        self.current_bytes += size
+        self.evict()
+        return None
+
+    def invalidate(self, file, current_mtime=None):
+        prefix = f"{source_prefix(file)}-"
+        current = f"{prefix}{current_mtime}-"
+        for name in [name for name in self.entries if name.startswith(prefix) and not name.startswith(current)]:
+            self.discard(name)
+
+    def discard(self, name):
+        size = self.entries.pop(name, None)
+        if size is None:
+            return
+        self.current_bytes -= size
+        try:
+            os.unlink(self.path(name))
+        except OSError as e:
+            logging.warning(f"Не удалось удалить '{name}' из кэша отрезков: {e}")
+
+    def evict(self):
+        while self.current_bytes > self.max_bytes and self.entries:
+            name = next(iter(self.entries))
+            self.discard(name)
+            self.evictions += 1
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "bytes": self.current_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -1,155 +1,900 @@
 import os
+import sys
 import json
+import math
+import mmap
+import time
+import queue
 import socket
-import tempfile
 import logging
-import select
-from pydub import AudioSegment
+import signal
+import argparse
+import selectors
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from dotenv import load_dotenv
+from jobs import cut_info_job, cut_job, init_worker, peaks_job
+from metadata_index import AUDIO_EXTENSIONS, MetadataIndex
+from peaks import PeaksStore, load_peaks, peaks_range
+from segment_cache import SegmentCache
+from stats import ServerStats
+from watcher import AudioDirWatcher
+from protocol import (MSG_DATA, MSG_END, MSG_ERROR, MSG_JSON, MSG_REQUEST, FrameDecoder, ProtocolError,
+                      pack_frame, pack_header, pack_json)
 
 load_dotenv()
-AUDIO_DIR = "audio_files"
-METADATA_FILE = "metadata.json"
+AUDIO_DIR = os.getenv("AUDIO_DIR", "audio_files")
+METADATA_FILE = os.getenv("METADATA_FILE", "metadata.json")
 HOST = os.getenv("HOST", "127.0.0.1")
 PORT = int(os.getenv("PORT", 65432))
+CHUNK_SIZE = 64 * 1024
+SENDFILE_CHUNK = 1024 * 1024
+CUT_WORKERS = int(os.getenv("CUT_WORKERS", os.cpu_count() or 1))
+SEGMENT_CACHE_DIR = os.getenv("SEGMENT_CACHE_DIR", "segment_cache")
+SEGMENT_CACHE_MB = int(os.getenv("SEGMENT_CACHE_MB", 1024))
+MAX_CLIENT_BUFFER = int(os.getenv("MAX_CLIENT_BUFFER", 4 * 1024 * 1024))
+# Запрос - это JSON-команда; самые большие из них (пакеты на MAX_BATCH_ITEMS отрезков) занимают сотни килобайт
+MAX_REQUEST_SIZE = int(os.getenv("MAX_REQUEST_KB", 512)) * 1024
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", 1))
+MAX_BATCH_ITEMS = int(os.getenv("MAX_BATCH_ITEMS", 1000))
+OUTPUT_FORMATS = ("mp3", "wav", "ogg", "flac")
+BITRATE_FORMATS = ("mp3", "ogg")
+SAMPLE_RATES = (8000, 11025, 16000, 22050, 24000, 32000, 44100, 48000)
+DOWNLOAD_CHUNK = int(os.getenv("DOWNLOAD_CHUNK_KB", 1024)) * 1024
+PEAKS_DIR = os.getenv("PEAKS_DIR", "peaks_cache")
+DEFAULT_PEAK_POINTS = 1000
+MAX_PEAK_POINTS = int(os.getenv("MAX_PEAK_POINTS", 10000))
+WATCH_AUDIO_DIR = os.getenv("WATCH_AUDIO_DIR", "1") == "1"
+WATCH_POLL_INTERVAL = float(os.getenv("WATCH_POLL_INTERVAL", 2.0))
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
 
+class FileRange:
+    # Часть исходящей очереди, которая передается с диска только при готовности сокета к записи
+    def __init__(self, path, offset, length, temporary=False):
+        self.path = path
+        self.offset = offset
+        self.length = length
+        self.temporary = temporary
+        # Файл открывается сразу: отрезок могут вытеснить из кэша, пока он ждет в очереди
+        self.file = open(path, "rb")
+        self.view = None
+        self.queued = time.perf_counter()
+
+    def send(self, sock):
+        if hasattr(os, "sendfile"):
+            sent = os.sendfile(sock.fileno(), self.file.fileno(), self.offset, min(self.length, SENDFILE_CHUNK))
+            if sent == 0:
+                raise OSError(f"Файл '{self.path}' оказался короче ожидаемого")
+        else:
+            # Без sendfile отправляем срезы отображенного в память файла, не копируя их
+            if self.view is None:
+                self.view = memoryview(mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ))
+            sent = sock.send(self.view[self.offset:self.offset + min(self.length, SENDFILE_CHUNK)])
+        self.offset += sent
+        self.length -= sent
+        return sent
+
+    def close(self):
+        if self.view is not None:
+            mapping = self.view.obj
+            self.view.release()
+            mapping.close()
+            self.view = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if self.temporary:
+            os.unlink(self.path)
+            self.temporary = False
+
+
+class RequestDone:
+    # Метка в исходящей очереди: все байты ответа на запрос переданы в сокет
+    def __init__(self, action, started):
+        self.action = action
+        self.started = started
+
+
+def discard_plan(plan):
+    if plan is not None and plan[4]:
+        os.unlink(plan[1])
+
+
+def slice_plan(plan, offset, length):
+    # Часть результата [offset, offset + length): сначала байты префикса, затем диапазон файла
+    prefix, path, body_offset, body_length, temporary = plan
+    total = len(prefix) + body_length
+    if offset >= total:
+        return None
+    length = min(length, total - offset)
+    head = prefix[offset:offset + length]
+    skip = max(0, offset - len(prefix))
+    return head, path, body_offset + skip, length - len(head), temporary
+
+
+def check_range(command, file_path):
+    # Параметры загрузки по частям: range = [смещение, длина], version = mtime файла из cut_info
+    byte_range = command.get("range")
+    if byte_range is not None:
+        if (not isinstance(byte_range, list) or len(byte_range) != 2
+                or not all(isinstance(value, int) and value >= 0 for value in byte_range) or not byte_range[1]):
+            return None, "Диапазон должен быть парой [смещение, длина] из неотрицательных целых чисел."
+        byte_range = tuple(byte_range)
+    version = command.get("version")
+    if version is not None and version != os.stat(file_path).st_mtime_ns:
+        return None, "Файл изменился, загрузку нужно начать заново."
+    return byte_range, None
+
+
+def check_output(command, file):
+    # Параметры перекодирования; пустой словарь, если результат совпадает с форматом исходного файла
+    options = {}
+    source_format = file.split('.')[-1]
+    file_format = command.get("format")
+    if file_format is not None:
+        if file_format not in OUTPUT_FORMATS:
+            return None, f"Формат должен быть одним из: {', '.join(OUTPUT_FORMATS)}."
+        if file_format != source_format:
+            options["format"] = file_format
+    bitrate = command.get("bitrate")
+    if bitrate is not None:
+        if (file_format or source_format) not in BITRATE_FORMATS:
+            return None, f"Битрейт задается только для форматов: {', '.join(BITRATE_FORMATS)}."
+        if not isinstance(bitrate, int) or not 8 <= bitrate <= 320:
+            return None, "Битрейт задается целым числом кбит/с от 8 до 320."
+        options["bitrate"] = bitrate
+    sample_rate = command.get("sample_rate")
+    if sample_rate is not None:
+        if sample_rate not in SAMPLE_RATES:
+            return None, f"Частота дискретизации должна быть одной из: {', '.join(map(str, SAMPLE_RATES))}."
+        options["sample_rate"] = sample_rate
+    return options, None
+
+
+def requested_files(command):
+    action = command.get("action")
+    if action in ("cut", "cut_info", "peaks"):
+        return [command.get("file")]
+    if action == "batch_cut" and isinstance(command.get("items"), list):
+        return [item.get("file") for item in command["items"] if isinstance(item, dict)]
+    return []
+
+
+def unknown_files(metadata_index, files):
+    # Файлы, которые уже лежат в каталоге, но еще не попали в индекс (например, при выключенном наблюдателе)
+    return sorted({
+        file for file in files
+        if isinstance(file, str) and file.endswith(AUDIO_EXTENSIONS) and os.path.basename(file) == file
+        and metadata_index.get(file) is None and os.path.isfile(os.path.join(AUDIO_DIR, file))
+    })
+
+
+def file_duration(metadata_index, file):
+    entry = metadata_index.get(file)
+    return int(entry["duration"]) if entry is not None else None
+
+
+def check_file(metadata_index, peer, command):
+    file = command.get("file", "")
+    if not isinstance(file, str):
+        file = ""
+    file_path = os.path.join(AUDIO_DIR, file)
+
+    duration = file_duration(metadata_index, file) if os.path.isfile(file_path) else None
+    if duration is None:
+        logging.error(f"[{peer}] Ошибка: Файл '{file}' не найден")
+        return None, "Файл не найден. Проверьте название и повторите попытку."
+    return (file, file_path, duration), None
+
+
+def check_cut(metadata_index, peer, command):
+    logging.info(f"[{peer}] Запрос обрезки файла '{command.get('file', '')}'")
+    checked, error = check_file(metadata_index, peer, command)
+    if error:
+        return None, error
+    file, file_path, duration = checked
+
+    try:
+        start = int(command["start"])
+        end = int(command["end"])
+    except (KeyError, TypeError, ValueError, OverflowError):
+        logging.error(f"[{peer}] Ошибка: Введены некорректные временные значения")
+        return None, "Временные значения должны быть целыми числами."
+
+    if start < 0 or end < 0:
+        logging.error(f"[{peer}] Ошибка: Время не может быть отрицательным")
+        return None, "Время не может быть отрицательным."
+    if start >= duration:
+        logging.error(f"[{peer}] Ошибка: Начальное время {start} выходит за пределы ({duration} сек)")
+        return None, f"Начальное время выходит за пределы длительности ({duration} сек)."
+    if end > duration:
+        logging.error(f"[{peer}] Ошибка: Конечное время {end} выходит за пределы ({duration} сек)")
+        return None, f"Конечное время выходит за пределы длительности ({duration} сек)."
+    if start >= end:
+        logging.error(f"[{peer}] Ошибка: Начальное время {start} >= конечного {end}")
+        return None, "Начальное время не может быть больше или равно конечному."
+
+    return (file, file_path, start, end), None
+
+
+def check_peaks(metadata_index, peer, command):
+    checked, error = check_file(metadata_index, peer, command)
+    if error:
+        return None, error
+    file, file_path, duration = checked
+    full_duration = metadata_index.get(file)["duration"]
+    try:
+        start = float(command.get("start") or 0)
+        end = float(command["end"]) if command.get("end") is not None else full_duration
+        points = int(command.get("points") or DEFAULT_PEAK_POINTS)
+    except (TypeError, ValueError, OverflowError):
+        return None, "Параметры start, end и points должны быть числами."
+    if not (math.isfinite(start) and math.isfinite(end)):
+        return None, "Параметры start и end должны быть конечными числами."
+    # Пики дальше конца файла не существуют, поэтому интервал обрезается по длительности
+    end = min(end, full_duration)
+    if not 0 <= start < end:
+        return None, "Начальное время должно быть неотрицательным и меньше конечного."
+    if not 0 < points <= MAX_PEAK_POINTS:
+        return None, f"Число точек должно быть от 1 до {MAX_PEAK_POINTS}."
+    return (file, file_path, os.stat(file_path).st_mtime_ns, start, end, points), None
+
+
 class AudioServer:
-    def __init__(self, host, port):
+    def __init__(self, host, port, cut_workers=CUT_WORKERS):
         self.address = (host, port)
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.inputs = [self.server_socket]
+        self.wakeup_reader, self.wakeup_writer = socket.socketpair()
+        self.wakeup_reader.setblocking(False)
+        self.wakeup_writer.setblocking(False)
+        self.selector = selectors.DefaultSelector()
+        self.interest = {}
+        self.dirty = set()
         self.client_buffers = {}
+        self.outboxes = {}
+        self.buffered = {}
+        self.batches = {}
+        self.requests = {}
+        self.stats = ServerStats()
+        self.pending_jobs = 0
+        self.metadata_index = MetadataIndex(AUDIO_DIR, METADATA_FILE)
+        self.segment_cache = SegmentCache(SEGMENT_CACHE_DIR, SEGMENT_CACHE_MB * 1024 * 1024)
+        self.peaks_store = PeaksStore(PEAKS_DIR)
+        # Запросы, ожидающие построения индекса пиков: путь индекса -> список (сокет, id, параметры)
+        self.peaks_waiters = {}
+        self.cut_workers = cut_workers
+        self.executor = None
+        # Длительность новых файлов определяется вне цикла событий: чтение заголовков, иногда декодирование
+        self.metadata_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="metadata")
+        self.completions = queue.Queue()
 
     def generate_metadata(self):
-        metadata = []
-        for file in os.listdir(AUDIO_DIR):
-            if file.endswith(".mp3") or file.endswith(".wav"):
-                file_path = os.path.join(AUDIO_DIR, file)
-                audio = AudioSegment.from_file(file_path)
-                metadata.append({
-                    "name": file,
-                    "duration": len(audio) / 1000,
-                    "format": file.split('.')[-1]
-                })
-
-        with open(METADATA_FILE, 'w', encoding='utf-8') as f:
-            json.dump(metadata, f, indent=4)
-        logging.info("Метаданные обновлены.")
-
-    def handle_request(self, sock, data):
+        self.metadata_index.load()
+        changed = self.metadata_index.refresh()
+        logging.info(f"Метаданные обновлены, изменено файлов: {len(changed)}.")
+
+    def queue_bytes(self, sock, data):
+        self.outboxes[sock].append(memoryview(data))
+        self.buffered[sock] += len(data)
+        self.dirty.add(sock)
+
+    def send_json(self, sock, request_id, obj):
+        self.queue_bytes(sock, pack_json(MSG_JSON, request_id, obj))
+
+    def send_error(self, sock, request_id, message):
+        self.stats.errors += 1
+        self.queue_bytes(sock, pack_json(MSG_ERROR, request_id, {"error": message}))
+        self.finish_request(sock, request_id)
+
+    def send_range(self, sock, request_id, prefix, path, offset, length, temporary=False, finish=True):
+        body = FileRange(path, offset, length, temporary)
+        self.queue_bytes(sock, pack_header(MSG_DATA, request_id, len(prefix) + length) + prefix)
+        self.outboxes[sock].append(body)
+        self.dirty.add(sock)
+        if finish:
+            self.queue_bytes(sock, pack_frame(MSG_END, request_id))
+            self.finish_request(sock, request_id)
+
+    def finish_request(self, sock, request_id):
+        request = self.requests.pop((sock, request_id), None)
+        if request is not None:
+            self.outboxes[sock].append(RequestDone(*request))
+
+    def flush(self, sock):
+        outbox = self.outboxes[sock]
+        self.dirty.add(sock)
+        while outbox:
+            item = outbox[0]
+            if isinstance(item, RequestDone):
+                self.stats.record(f"total.{item.action}", time.perf_counter() - item.started)
+                outbox.popleft()
+            elif isinstance(item, FileRange):
+                if item.length:
+                    try:
+                        self.stats.bytes_sent += item.send(sock)
+                    except BlockingIOError:
+                        return
+                if not item.length:
+                    self.stats.record("send", time.perf_counter() - item.queued)
+                    item.close()
+                    outbox.popleft()
+            else:
+                try:
+                    sent = sock.send(item)
+                except BlockingIOError:
+                    return
+                self.stats.bytes_sent += sent
+                self.buffered[sock] -= sent
+                if sent < len(item):
+                    outbox[0] = item[sent:]
+                else:
+                    outbox.popleft()
+
+    def handle_frame(self, sock, msg_type, request_id, payload):
+        if msg_type != MSG_REQUEST:
+            logging.warning(f"[{sock.getpeername()}] Неожиданный тип кадра {msg_type}")
+            self.send_error(sock, request_id, "Ожидался кадр запроса")
+            return
         try:
-            command = json.loads(data.decode("utf-8"))
-        except json.JSONDecodeError:
+            command = json.loads(payload.decode("utf-8"))
+        except (UnicodeDecodeError, json.JSONDecodeError):
             logging.warning(f"[{sock.getpeername()}] Некорректный JSON")
-            sock.send(json.dumps({"error": "Некорректный формат запроса"}).encode("utf-8"))
+            self.send_error(sock, request_id, "Некорректный формат запроса")
+            return
+        if not isinstance(command, dict):
+            self.send_error(sock, request_id, "Некорректный формат запроса")
             return
+        self.handle_request(sock, request_id, command)
 
-        if command["action"] == "list":
-            logging.info(f"[{sock.getpeername()}] Запрос списка файлов")
-            with open(METADATA_FILE, 'r', encoding='utf-8') as f:
-                response = f.read()
-            sock.send(response.encode('utf-8'))
+    def cached_segment(self, file, file_path, start, end, options=None):
+        # Перекодированные версии кэшируются рядом с обычными, параметры входят в имя записи
+        options = dict(options or {})
+        file_format = options.pop("format", None) or file.split('.')[-1]
+        mtime = os.stat(file_path).st_mtime_ns
+        cache_name = self.segment_cache.entry_name(file, mtime, start, end, file_format, **options)
+        cached_path = self.segment_cache.get(cache_name)
+        if cached_path is None:
+            self.segment_cache.invalidate(file, mtime)
+            return cache_name, None
+        return cache_name, (b"", cached_path, 0, os.path.getsize(cached_path), False)
 
-        elif command["action"] == "cut":
-            file = command["file"]
-            file_path = os.path.join(AUDIO_DIR, file)
+    def submit_job(self, callback, fn, *args):
+        self.pending_jobs += 1
+        submitted = time.perf_counter()
+        future = self.executor.submit(fn, *args)
+        future.add_done_callback(lambda f: self.call_from_thread(self.complete_job, callback, submitted, f))
 
-            logging.info(f"[{sock.getpeername()}] Запрос обрезки файла '{file}'")
+    def complete_job(self, callback, submitted, future):
+        self.pending_jobs -= 1
+        self.stats.record("job", time.perf_counter() - submitted)
+        callback(future)
 
-            if not os.path.exists(file_path):
-                logging.error(f"[{sock.getpeername()}] Ошибка: Файл '{file}' не найден")
-                sock.send(
-                    json.dumps({"error": "Файл не найден. Проверьте название и повторите попытку."}).encode("utf-8"))
-                return
+    def call_from_thread(self, fn, *args):
+        # Вызывается из других потоков (пул, наблюдатель): передаем вызов в цикл событий
+        self.completions.put((fn, args))
+        try:
+            self.wakeup_writer.send(b"\0")
+        except BlockingIOError:
+            pass
 
+    def process_completions(self):
+        try:
+            self.wakeup_reader.recv(4096)
+        except BlockingIOError:
+            pass
+        while True:
             try:
-                start = int(command["start"])
-                end = int(command["end"])
-            except ValueError:
-                logging.error(f"[{sock.getpeername()}] Ошибка: Введены некорректные временные значения")
-                sock.send(json.dumps({"error": "Временные значения должны быть целыми числами."}).encode("utf-8"))
+                fn, args = self.completions.get_nowait()
+            except queue.Empty:
                 return
+            # Ошибка одного обработчика не должна останавливать цикл событий для остальных клиентов
+            try:
+                fn(*args)
+            except Exception as e:
+                logging.error(f"Ошибка при обработке завершенной задачи: {e}")
+
+    def apply_metadata(self, removed, updated):
+        changed = self.metadata_index.apply(removed, updated)
+        for file in changed:
+            entry = self.metadata_index.get(file)
+            self.segment_cache.invalidate(file, entry["mtime"] if entry else None)
+            self.peaks_store.invalidate(file, entry["mtime"] if entry else None)
+        if changed:
+            logging.info(f"Каталог изменился, обновлены метаданные: {', '.join(sorted(changed))}")
+
+    def start_watcher(self):
+        if not WATCH_AUDIO_DIR:
+            return
+        # Заголовки измененных файлов читаются в потоке наблюдателя, в цикл событий передается готовый результат
+        watcher = AudioDirWatcher(
+            AUDIO_DIR, lambda names: self.call_from_thread(self.apply_metadata, *self.metadata_index.collect(names)),
+            WATCH_POLL_INTERVAL)
+        watcher.start()
+
+    def refresh_files(self, names, callback):
+        future = self.metadata_executor.submit(self.metadata_index.collect, names)
+        future.add_done_callback(lambda f: self.call_from_thread(self.finish_refresh, callback, f))
 
-            audio = AudioSegment.from_file(file_path)
-            duration = len(audio) // 1000
+    def finish_refresh(self, callback, future):
+        try:
+            removed, updated = future.result()
+        except Exception as e:
+            logging.error(f"Не удалось обновить метаданные: {e}")
+        else:
+            self.apply_metadata(removed, updated)
+        callback()
 
-            if start < 0 or end < 0:
-                logging.error(f"[{sock.getpeername()}] Ошибка: Время не может быть отрицательным")
-                sock.send(json.dumps({"error": "Время не может быть отрицательным."}).encode("utf-8"))
+    def retry_request(self, sock, request_id, command):
+        if sock not in self.client_buffers:
+            return
+        try:
+            self.handle_request(sock, request_id, command, refreshed=True)
+        except Exception as e:
+            logging.error(f"Ошибка при обработке запроса: {e}")
+            self.close_client(sock)
+
+    def job_results(self, future, cache_names, description):
+        try:
+            results, timings = future.result()
+        except Exception as e:
+            logging.error(f"Ошибка обработки задачи ({description}): {e}")
+            return [None] * len(cache_names)
+        self.stats.record_timings(timings)
+        for index, (plan, cache_name) in enumerate(zip(results, cache_names)):
+            if plan is not None and cache_name is not None and not plan[4]:
+                temp_path = self.segment_cache.add(cache_name)
+                if temp_path is not None:
+                    # Не поместился в кэш: отправляется как временный файл и удаляется после передачи
+                    results[index] = (plan[0], temp_path, plan[2], plan[3], True)
+        return results
+
+    def finish_cut(self, sock, request_id, description, cache_name, byte_range, future):
+        plan = self.job_results(future, [cache_name], description)[0]
+        if sock not in self.client_buffers:
+            discard_plan(plan)
+        elif plan is None:
+            self.send_error(sock, request_id, "Не удалось обработать аудиофайл.")
+        else:
+            error = self.send_plan(sock, request_id, plan, description, byte_range=byte_range)
+            if error:
+                self.send_error(sock, request_id, error)
+
+    def finish_cut_info(self, sock, request_id, description, cache_name, version, future):
+        try:
+            info, timings = future.result()
+        except Exception as e:
+            logging.error(f"Ошибка обработки задачи ({description}): {e}")
+            info, timings = None, {}
+        self.stats.record_timings(timings)
+        if info is not None and cache_name is not None:
+            temp_path = self.segment_cache.add(cache_name)
+            if temp_path is not None:
+                # Части такого результата будут вырезаться заново при каждом запросе диапазона
+                os.unlink(temp_path)
+        if sock not in self.client_buffers:
+            return
+        if info is None:
+            self.send_error(sock, request_id, "Не удалось обработать аудиофайл.")
+            return
+        size, digests = info
+        self.send_json(sock, request_id, {"size": size, "chunk_size": DOWNLOAD_CHUNK, "sha256": digests,
+                                          "version": version})
+        self.finish_request(sock, request_id)
+
+    def send_plan(self, sock, request_id, plan, description, finish=True, byte_range=None):
+        # Возвращает текст ошибки, если результат не поставлен в очередь; сообщить о ней должен вызывающий
+        if byte_range is not None:
+            sliced = slice_plan(plan, *byte_range)
+            if sliced is None:
+                discard_plan(plan)
+                return "Диапазон выходит за пределы результата."
+            plan = sliced
+            description = f"{description}, байты {byte_range[0]}-{byte_range[0] + plan[3] + len(plan[0])}"
+        prefix, path, offset, length, temporary = plan
+        try:
+            self.send_range(sock, request_id, prefix, path, offset, length, temporary, finish)
+        except OSError as e:
+            logging.error(f"Не удалось открыть результат ({description}): {e}")
+            discard_plan(plan)
+            return "Не удалось обработать аудиофайл."
+        logging.info(f"[{sock.getpeername()}] Поставлен в очередь отправки {description}")
+        return None
+
+    def start_batch(self, sock, request_id, items, exact, output):
+        # output: общие для пакета параметры перекодирования (format, bitrate, sample_rate)
+        peer = sock.getpeername()
+        slots = [None] * len(items)
+        groups = {}
+        for index, item in enumerate(items):
+            if isinstance(item, dict):
+                cut, error = check_cut(self.metadata_index, peer, item)
+                if not error:
+                    options, error = check_output(output, cut[0])
+            else:
+                cut, error = None, "Некорректный элемент пакета."
+            if error:
+                slots[index] = ({"index": index, "error": error}, None)
+                continue
+            file, file_path, start, end = cut
+            meta = {"index": index, "file": file, "start": start, "end": end}
+            cache_name = None
+            if exact or options:
+                cache_name, cached = self.cached_segment(file, file_path, start, end, options)
+                if cached is not None:
+                    slots[index] = (meta, cached)
+                    continue
+            groups.setdefault(file_path, (options, []))[1].append((index, meta, cache_name))
+
+        self.batches[(sock, request_id)] = {"slots": slots, "next": 0}
+        # Одна задача на исходный файл: он декодируется или сканируется один раз на весь пакет
+        for file_path, (options, entries) in groups.items():
+            ranges = [(meta["start"], meta["end"]) for _, meta, _ in entries]
+            output_paths = [self.segment_cache.path(name) if name else None for _, _, name in entries]
+            self.submit_job(lambda f, entries=entries: self.finish_batch_group(sock, request_id, entries, f),
+                            cut_job, file_path, ranges, exact, output_paths, options)
+        self.flush_batch(sock, request_id)
+
+    def finish_batch_group(self, sock, request_id, entries, future):
+        description = f"пакет {request_id}"
+        results = self.job_results(future, [name for _, _, name in entries], description)
+        batch = self.batches.get((sock, request_id))
+        for (index, meta, _), plan in zip(entries, results):
+            if batch is None:
+                discard_plan(plan)
+            elif plan is None:
+                batch["slots"][index] = (dict(meta, error="Не удалось обработать аудиофайл."), None)
+            else:
+                batch["slots"][index] = (meta, plan)
+        if batch is not None:
+            self.flush_batch(sock, request_id)
+
+    def flush_batch(self, sock, request_id):
+        # Результаты пакета отправляются строго по порядку элементов
+        batch = self.batches[(sock, request_id)]
+        slots = batch["slots"]
+        while batch["next"] < len(slots) and slots[batch["next"]] is not None:
+            meta, plan = slots[batch["next"]]
+            slots[batch["next"]] = True
+            batch["next"] += 1
+            if plan is not None:
+                self.queue_bytes(sock, pack_json(MSG_JSON, request_id, meta))
+                description = f"отрезок {meta['index']} пакета {request_id}"
+                error = self.send_plan(sock, request_id, plan, description, finish=False)
+                if not error:
+                    continue
+                meta = dict(meta, error=error)
+            self.stats.errors += 1
+            self.queue_bytes(sock, pack_json(MSG_ERROR, request_id, meta))
+        if batch["next"] == len(slots):
+            del self.batches[(sock, request_id)]
+            self.queue_bytes(sock, pack_frame(MSG_END, request_id))
+            self.finish_request(sock, request_id)
+
+    def request_peaks(self, sock, request_id, query):
+        file, file_path, mtime, start, end, points = query
+        path = self.peaks_store.path(file, mtime)
+        if os.path.exists(path):
+            self.send_peaks(sock, request_id, path, query)
+            return
+        # Индекс строится один раз на версию файла, одновременные запросы ждут одну задачу
+        waiters = self.peaks_waiters.get(path)
+        if waiters is not None:
+            waiters.append((sock, request_id, query))
+            return
+        logging.info(f"[{sock.getpeername()}] Построение индекса пиков '{file}'")
+        self.peaks_waiters[path] = [(sock, request_id, query)]
+        self.submit_job(lambda f: self.finish_peaks(path, f), peaks_job, file_path, path)
+
+    def finish_peaks(self, path, future):
+        waiters = self.peaks_waiters.pop(path, [])
+        try:
+            _, timings = future.result()
+        except Exception as e:
+            logging.error(f"Не удалось построить индекс пиков '{path}': {e}")
+            for sock, request_id, _ in waiters:
+                if sock in self.client_buffers:
+                    self.send_error(sock, request_id, "Не удалось построить индекс пиков.")
+            return
+        self.stats.record_timings(timings)
+        for sock, request_id, query in waiters:
+            if sock in self.client_buffers:
+                self.send_peaks(sock, request_id, path, query)
+
+    def send_peaks(self, sock, request_id, path, query):
+        file, _, _, start, end, points = query
+        try:
+            peaks = peaks_range(load_peaks(path), start, end, points)
+        except (OSError, ValueError, OverflowError) as e:
+            logging.error(f"Не удалось прочитать индекс пиков '{path}': {e}")
+            self.send_error(sock, request_id, "Не удалось прочитать индекс пиков.")
+            return
+        # Пары (минимум, максимум) передаются одним кадром DATA как int16 little-endian
+        data = peaks.astype("<i2").tobytes()
+        self.send_json(sock, request_id, {"file": file, "start": start, "end": end, "points": len(peaks),
+                                          "dtype": "int16", "layout": "min,max"})
+        self.queue_bytes(sock, pack_frame(MSG_DATA, request_id, data))
+        self.queue_bytes(sock, pack_frame(MSG_END, request_id))
+        self.finish_request(sock, request_id)
+
+    def stats_snapshot(self):
+        return self.stats.snapshot(
+            clients=len(self.client_buffers),
+            queue={
+                "jobs": self.pending_jobs,
+                "batches": len(self.batches),
+                "outbox_bytes": sum(self.buffered.values()),
+            },
+            files=len(self.metadata_index.entries),
+            segment_cache=self.segment_cache.stats(),
+            decode_cache=self.stats.decode_cache_snapshot(),
+        )
+
+    def handle_request(self, sock, request_id, command, refreshed=False):
+        unknown = [] if refreshed else unknown_files(self.metadata_index, requested_files(command))
+        if unknown:
+            # Запрос обрабатывается после того, как новые файлы попадут в индекс
+            self.refresh_files(unknown, lambda: self.retry_request(sock, request_id, command))
+            return
+        action = command.get("action")
+        if action in ("list", "cut", "cut_info", "batch_cut", "peaks", "stats"):
+            self.stats.requests[action] += 1
+            self.requests[(sock, request_id)] = (action, time.perf_counter())
+        if action == "list":
+            logging.info(f"[{sock.getpeername()}] Запрос списка файлов")
+            try:
+                response = self.metadata_index.list_payload(command)
+            except ValueError as e:
+                self.send_error(sock, request_id, str(e))
                 return
-            if start >= duration:
-                logging.error(
-                    f"[{sock.getpeername()}] Ошибка: Начальное время {start} выходит за пределы ({duration} сек)")
-                sock.send(
-                    json.dumps({"error": f"Начальное время выходит за пределы длительности ({duration} сек)."}).encode(
-                        "utf-8"))
+            self.queue_bytes(sock, pack_frame(MSG_JSON, request_id, response))
+            self.finish_request(sock, request_id)
+
+        elif action == "stats":
+            self.send_json(sock, request_id, self.stats_snapshot())
+            self.finish_request(sock, request_id)
+
+        elif action == "peaks":
+            query, error = check_peaks(self.metadata_index, sock.getpeername(), command)
+            if error:
+                self.send_error(sock, request_id, error)
                 return
-            if end > duration:
-                logging.error(
-                    f"[{sock.getpeername()}] Ошибка: Конечное время {end} выходит за пределы ({duration} сек)")
-                sock.send(
-                    json.dumps({"error": f"Конечное время выходит за пределы длительности ({duration} сек)."}).encode(
-                        "utf-8"))
+            self.request_peaks(sock, request_id, query)
+
+        elif action in ("cut", "cut_info"):
+            cut, error = check_cut(self.metadata_index, sock.getpeername(), command)
+            if not error:
+                file, file_path, start, end = cut
+                byte_range, error = check_range(command, file_path)
+            if not error:
+                options, error = check_output(command, file)
+            if error:
+                self.send_error(sock, request_id, error)
                 return
-            if start >= end:
-                logging.error(f"[{sock.getpeername()}] Ошибка: Начальное время {start} >= конечного {end}")
-                sock.send(
-                    json.dumps({"error": "Начальное время не может быть больше или равно конечному."}).encode("utf-8"))
+
+            description = f"обрезанный файл '{file}' ({start}-{end} сек)"
+            if options:
+                description += f", {', '.join(f'{key}={value}' for key, value in sorted(options.items()))}"
+            exact = bool(command.get("exact"))
+            cache_name = cached = None
+            if exact or options:
+                cache_name, cached = self.cached_segment(file, file_path, start, end, options)
+                if cached is not None and action == "cut":
+                    error = self.send_plan(sock, request_id, cached, f"из кэша {description}", byte_range=byte_range)
+                    if error:
+                        self.send_error(sock, request_id, error)
+                    return
+            output_path = self.segment_cache.path(cache_name) if cache_name else None
+
+            if action == "cut_info":
+                # Размер и контрольные суммы блоков, по которым клиент качает результат частями
+                logging.info(f"[{sock.getpeername()}] Описание отрезка '{file}' ({start}-{end} сек)")
+                version = os.stat(file_path).st_mtime_ns
+                self.submit_job(lambda f: self.finish_cut_info(sock, request_id, description, cache_name, version, f),
+                                cut_info_job, file_path, start, end, exact, output_path, DOWNLOAD_CHUNK, cached,
+                                options)
                 return
 
             logging.info(f"[{sock.getpeername()}] Обрезка файла '{file}' с {start} сек до {end} сек")
-            segment = audio[start * 1000:end * 1000]
+            self.submit_job(lambda f: self.finish_cut(sock, request_id, description, cache_name, byte_range, f),
+                            cut_job, file_path, [(start, end)], exact, [output_path], options)
+
+        elif action == "batch_cut":
+            items = command.get("items")
+            if not isinstance(items, list) or not items:
+                self.send_error(sock, request_id, "Пакет должен содержать непустой список отрезков.")
+                return
+            if len(items) > MAX_BATCH_ITEMS:
+                self.send_error(sock, request_id, f"Пакет не может содержать больше {MAX_BATCH_ITEMS} отрезков.")
+                return
+            logging.info(f"[{sock.getpeername()}] Пакетная обрезка: {len(items)} отрезков")
+            self.start_batch(sock, request_id, items, bool(command.get("exact")), command)
+
+        else:
+            logging.warning(f"[{sock.getpeername()}] Неизвестное действие '{action}'")
+            self.send_error(sock, request_id, "Неизвестное действие.")
+
+    def update_interest(self, sock):
+        # Клиенты с переполненным буфером не читаются, пока не заберут накопленные ответы
+        events = 0
+        if self.buffered[sock] <= MAX_CLIENT_BUFFER:
+            events |= selectors.EVENT_READ
+        if self.outboxes[sock]:
+            events |= selectors.EVENT_WRITE
+        registered = self.interest.get(sock, 0)
+        if events == registered:
+            return
+        if not registered:
+            self.selector.register(sock, events)
+        elif not events:
+            self.selector.unregister(sock)
+        else:
+            self.selector.modify(sock, events)
+        self.interest[sock] = events
 
-            with tempfile.NamedTemporaryFile(delete=False, suffix=f".{file.split('.')[-1]}") as temp_file:
-                segment.export(temp_file.name, format=file.split('.')[-1])
-                temp_file.close()
+    def accept_client(self):
+        try:
+            client_socket, addr = self.server_socket.accept()
+        except BlockingIOError:
+            return
+        logging.info(f"Новое подключение от {addr}")
+        client_socket.setblocking(False)
+        self.client_buffers[client_socket] = FrameDecoder(MAX_REQUEST_SIZE)
+        self.outboxes[client_socket] = deque()
+        self.buffered[client_socket] = 0
+        self.dirty.add(client_socket)
 
-                with open(temp_file.name, "rb") as f:
-                    sock.sendall(f.read())
-                os.unlink(temp_file.name)
+    def read_client(self, sock):
+        try:
+            data = sock.recv(CHUNK_SIZE)
+        except OSError as e:
+            logging.error(f"Ошибка при приеме данных: {e}")
+            self.close_client(sock)
+            return
+        if not data:
+            self.close_client(sock)
+            logging.info(f"Клиент отключен")
+            return
+        self.client_buffers[sock].append(data)
+        self.handle_frames(sock)
 
-            logging.info(f"[{sock.getpeername()}] Отправлен обрезанный файл '{file}' ({start}-{end} сек)")
+    def handle_frames(self, sock):
+        # Кадры разбираются, пока у клиента не накопилось слишком много неотправленных ответов;
+        # остальные ждут в декодере и разбираются после отправки (чтение сокета при этом выключено)
+        decoder = self.client_buffers[sock]
+        try:
+            while sock in self.client_buffers and self.buffered[sock] <= MAX_CLIENT_BUFFER:
+                frame = decoder.next_frame()
+                if frame is None:
+                    break
+                self.handle_frame(sock, *frame)
+        except ProtocolError as e:
+            logging.error(f"Ошибка протокола: {e}")
+            self.close_client(sock)
+        except Exception as e:
+            logging.error(f"Ошибка при приеме данных: {e}")
+            self.close_client(sock)
 
-    def run(self):
-        self.generate_metadata()
+    def listen(self, reuse_port=False):
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         self.server_socket.bind(self.address)
         self.server_socket.listen()
         self.server_socket.setblocking(False)
-        logging.info(f"Сервер запущен на {self.address[0]}:{self.address[1]}")
 
+    def run(self, reuse_port=False, load_metadata=True):
+        if load_metadata:
+            self.generate_metadata()
+        self.segment_cache.load()
+        self.peaks_store.load()
+        # При нескольких процессах сервера в каждом пуле CUT_WORKERS // workers процессов, всего не больше CUT_WORKERS
+        self.executor = ProcessPoolExecutor(max_workers=self.cut_workers, initializer=init_worker,
+                                            initargs=(max(self.cut_workers, CUT_WORKERS),))
+        self.listen(reuse_port)
+        self.start_watcher()
+        self.selector.register(self.server_socket, selectors.EVENT_READ)
+        self.selector.register(self.wakeup_reader, selectors.EVENT_READ)
+        logging.info(f"Сервер запущен на {self.address[0]}:{self.address[1]} (pid {os.getpid()})")
+        try:
+            self.serve_forever()
+        finally:
+            # Без явной остановки процессы пула переживают сервер, ожидая новых задач
+            self.executor.shutdown(cancel_futures=True)
+            self.metadata_executor.shutdown(cancel_futures=True)
+
+    def serve_forever(self):
         while True:
-            readable, _, exceptional = select.select(self.inputs, [], self.inputs)
-            for sock in readable:
-                if sock is self.server_socket:
-                    client_socket, addr = self.server_socket.accept()
-                    logging.info(f"Новое подключение от {addr}")
-                    client_socket.setblocking(False)
-                    self.inputs.append(client_socket)
-                    self.client_buffers[client_socket] = b""
+            for sock in self.dirty:
+                if sock in self.client_buffers:
+                    self.update_interest(sock)
+            self.dirty.clear()
+
+            for key, events in self.selector.select():
+                sock = key.fileobj
+                if sock is self.wakeup_reader:
+                    self.process_completions()
+                elif sock is self.server_socket:
+                    self.accept_client()
                 else:
-                    try:
-                        data = sock.recv(4096)
-                        if data:
-                            self.handle_request(sock, data)
-                        else:
-                            self.inputs.remove(sock)
-                            sock.close()
-                            del self.client_buffers[sock]
-                            logging.info(f"Клиент отключен")
-                    except Exception as e:
-                        logging.error(f"Ошибка при приеме данных: {e}")
-                        self.inputs.remove(sock)
-                        sock.close()
-
-            for sock in exceptional:
-                self.inputs.remove(sock)
-                sock.close()
-                logging.warning("Закрытие неисправного сокета")
+                    if events & selectors.EVENT_WRITE and sock in self.outboxes:
+                        try:
+                            self.flush(sock)
+                        except OSError as e:
+                            logging.error(f"Ошибка при отправке данных: {e}")
+                            self.close_client(sock)
+                    if sock in self.client_buffers:
+                        self.handle_frames(sock)
+                    if events & selectors.EVENT_READ and sock in self.client_buffers:
+                        self.read_client(sock)
+
+    def close_client(self, sock):
+        if self.interest.pop(sock, 0):
+            self.selector.unregister(sock)
+        self.dirty.discard(sock)
+        self.client_buffers.pop(sock, None)
+        self.buffered.pop(sock, None)
+        for item in self.outboxes.pop(sock, ()):
+            if isinstance(item, FileRange):
+                item.close()
+        for key in [key for key in self.requests if key[0] is sock]:
+            del self.requests[key]
+        for key in [key for key in self.batches if key[0] is sock]:
+            for slot in self.batches.pop(key)["slots"]:
+                if isinstance(slot, tuple):
+                    discard_plan(slot[1])
+        sock.close()
+
+
+def serve(host, port, workers=1):
+    # Несколько процессов слушают один порт через SO_REUSEPORT; ядро распределяет между ними подключения
+    if workers <= 1 or not hasattr(socket, "SO_REUSEPORT") or not hasattr(os, "fork"):
+        if workers > 1:
+            logging.warning("SO_REUSEPORT недоступен, сервер запускается в одном процессе")
+        AudioServer(host, port).run()
+        return
+
+    metadata_index = MetadataIndex(AUDIO_DIR, METADATA_FILE)
+    metadata_index.load()
+    changed = metadata_index.refresh()
+    logging.info(f"Метаданные обновлены, изменено файлов: {len(changed)}.")
+
+    cut_workers = max(1, CUT_WORKERS // workers)
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            # Индекс метаданных наследуется от родителя, дальше каждый процесс обновляет свою копию сам
+            signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            server = AudioServer(host, port, cut_workers=cut_workers)
+            server.metadata_index = metadata_index
+            try:
+                server.run(reuse_port=True, load_metadata=False)
+            finally:
+                os._exit(0)
+        children.append(pid)
+
+    logging.info(f"Запущено рабочих процессов: {workers}")
+    try:
+        for _ in children:
+            os.wait()
+    except KeyboardInterrupt:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in children:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
 
 
 if __name__ == "__main__":
-    server = AudioServer(HOST, PORT)
-    server.run()
+    parser = argparse.ArgumentParser(description="Аудиосервер")
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS, help="число процессов-обработчиков")
+    args = parser.parse_args()
+    serve(HOST, PORT, args.workers)
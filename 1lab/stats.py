@@ -0,0 +1,148 @@
+import os
+import sys
+import time
+import multiprocessing
+from collections import Counter
+
+# Гистограмма в духе HDR: значения в микросекундах, 64 поддиапазона на каждую степень двойки (погрешность < 1.6%)
+SUB_BUCKET_BITS = 7
+SUB_BUCKET_HALF = 1 << (SUB_BUCKET_BITS - 1)
+PERCENTILES = (50, 90, 95, 99, 99.9)
+CACHE_COUNTERS = ("entries", "bytes", "max_bytes", "hits", "misses", "evictions")
+
+
+def bucket_index(value):
+    if value < (1 << SUB_BUCKET_BITS):
+        return value
+    shift = value.bit_length() - SUB_BUCKET_BITS
+    return shift * SUB_BUCKET_HALF + (value >> shift)
+
+
+def bucket_value(index):
+    # Верхняя граница поддиапазона, чтобы перцентили не занижались
+    if index < (1 << SUB_BUCKET_BITS):
+        return index
+    shift, top = divmod(index - SUB_BUCKET_HALF, SUB_BUCKET_HALF)
+    return ((top + SUB_BUCKET_HALF) << shift) + (1 << shift) - 1
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.counts = Counter()
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def record(self, seconds):
+        value = max(0, int(seconds * 1_000_000))
+        self.counts[bucket_index(value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        self.counts.update(other.counts)
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+
+    def percentile(self, percent):
+        if not self.count:
+            return 0
+        target = max(1, round(self.count * percent / 100))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                return min(bucket_value(index), self.max)
+        return self.max
+
+    def snapshot(self):
+        # Все значения в миллисекундах
+        result = {
+            "count": self.count,
+            "min": (self.min or 0) / 1000,
+            "mean": round(self.total / self.count / 1000, 3) if self.count else 0,
+            "max": self.max / 1000,
+        }
+        for percent in PERCENTILES:
+            result[f"p{percent:g}"] = self.percentile(percent) / 1000
+        return result
+
+
+def rss_bytes(pid="self"):
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def memory_usage():
+    # rss_bytes и max_rss_bytes относятся к процессу цикла событий; children_* - к его дочерним процессам
+    # (пулу обрезки): текущий RSS живых процессов и пиковый RSS уже завершенных (RUSAGE_CHILDREN)
+    usage = {}
+    rss = rss_bytes()
+    if rss is not None:
+        usage["rss_bytes"] = rss
+    children = [child_rss for child_rss in (rss_bytes(child.pid) for child in multiprocessing.active_children())
+                if child_rss is not None]
+    usage["children"] = len(children)
+    if rss is not None:
+        usage["children_rss_bytes"] = sum(children)
+        usage["total_rss_bytes"] = rss + sum(children)
+    try:
+        import resource
+        # На macOS ru_maxrss в байтах, на Linux в килобайтах
+        scale = 1 if sys.platform == "darwin" else 1024
+        usage["max_rss_bytes"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+        usage["children_max_rss_bytes"] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+    except ImportError:
+        pass
+    return usage
+
+
+class ServerStats:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.requests = Counter()
+        self.errors = 0
+        self.bytes_sent = 0
+        self.phases = {}
+        self.decode_caches = {}
+
+    def record(self, phase, seconds):
+        histogram = self.phases.get(phase)
+        if histogram is None:
+            histogram = self.phases[phase] = LatencyHistogram()
+        histogram.record(seconds)
+
+    def record_timings(self, timings):
+        for phase, seconds in timings.items():
+            if phase == "decode_cache":
+                # Последние счетчики кэша декодированных файлов от каждого процесса пула
+                self.decode_caches[seconds["pid"]] = seconds
+            else:
+                self.record(phase, seconds)
+
+    def decode_cache_snapshot(self):
+        caches = list(self.decode_caches.values())
+        result = {key: sum(cache[key] for cache in caches) for key in CACHE_COUNTERS}
+        result["processes"] = len(caches)
+        return result
+
+    def snapshot(self, **extra):
+        return dict({
+            "status": "ok",
+            "pid": os.getpid(),
+            "uptime": round(time.monotonic() - self.started, 3),
+            "requests": dict(self.requests),
+            "errors": self.errors,
+            "bytes_sent": self.bytes_sent,
+            "latency_ms": {phase: histogram.snapshot() for phase, histogram in sorted(self.phases.items())},
+            "memory": memory_usage(),
+        }, **extra)
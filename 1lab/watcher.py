@@ -0,0 +1,113 @@
+import os
+import sys
+import select
+import struct
+import ctypes
+import ctypes.util
+import logging
+import threading
+
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+WATCH_MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT_HEADER = struct.Struct("iIII")
+
+# Пауза, за которую накопленные события объединяются в одно обновление
+SETTLE_DELAY = 0.5
+
+
+def load_inotify():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class AudioDirWatcher(threading.Thread):
+    # callback(names) вызывается из потока наблюдателя; None означает "перечитать каталог целиком"
+    def __init__(self, directory, callback, poll_interval=2.0):
+        super().__init__(name="audio-dir-watcher", daemon=True)
+        self.directory = directory
+        self.callback = callback
+        self.poll_interval = poll_interval
+        self.stopped = threading.Event()
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        libc = load_inotify()
+        fd = libc.inotify_init1(os.O_CLOEXEC) if libc else -1
+        if fd < 0:
+            logging.info(f"inotify недоступен, каталог '{self.directory}' опрашивается раз в {self.poll_interval} сек")
+            self.poll()
+            return
+        try:
+            if libc.inotify_add_watch(fd, os.fsencode(self.directory), WATCH_MASK) < 0:
+                logging.warning(f"Не удалось подписаться на '{self.directory}', переход на опрос")
+                self.poll()
+                return
+            logging.info(f"Наблюдение за каталогом '{self.directory}' через inotify")
+            self.watch(fd)
+        finally:
+            os.close(fd)
+
+    def watch(self, fd):
+        pending = set()
+        while not self.stopped.is_set():
+            timeout = SETTLE_DELAY if pending else 1.0
+            readable, _, _ = select.select([fd], [], [], timeout)
+            if not readable:
+                if pending:
+                    self.notify(None if None in pending else pending)
+                    pending = set()
+                continue
+            data = os.read(fd, 64 * 1024)
+            offset = 0
+            while offset < len(data):
+                _, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b"\0")
+                offset += EVENT_HEADER.size + length
+                if mask & IN_Q_OVERFLOW:
+                    pending.add(None)
+                elif name:
+                    pending.add(os.fsdecode(name))
+
+    def poll(self):
+        previous = self.snapshot()
+        while not self.stopped.wait(self.poll_interval):
+            current = self.snapshot()
+            changed = {name for name in previous.keys() | current.keys() if previous.get(name) != current.get(name)}
+            previous = current
+            if changed:
+                self.notify(changed)
+
+    def snapshot(self):
+        files = {}
+        try:
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    files[entry.name] = (stat.st_size, stat.st_mtime_ns)
+        except OSError as e:
+            logging.error(f"Не удалось прочитать каталог '{self.directory}': {e}")
+        return files
+
+    def notify(self, names):
+        try:
+            self.callback(names)
+        except Exception as e:
+            logging.error(f"Ошибка обработки изменений каталога: {e}")
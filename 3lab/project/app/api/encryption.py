@@ -1,14 +1,23 @@
 
-from fastapi import APIRouter, Depends, HTTPException
+import codecs
+from tempfile import SpooledTemporaryFile
+from fastapi import APIRouter, Depends, Header, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, JWTError
 from app.schemas.encryption import EncodeRequest, EncodeResponse, DecodeRequest, DecodeResponse
-from app.services.encryption_service import encode_text, decode_text
+from app.services.encryption_service import (encode_text, decode_text, encode_stream, decode_stream, check_stream,
+                                             text_blocks, shared_code_map, block_executor, STREAM_BLOCK)
 from app.core.config import settings
 
 router = APIRouter()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login/")
 
+# Тело потокового запроса до этого размера держится в памяти, больше - уходит во временный файл
+SPOOL_MEMORY_LIMIT = 8 * 1024 * 1024
+STREAM_READ_SIZE = 1 << 16
+
 def get_current_user(token: str = Depends(oauth2_scheme)):
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
@@ -19,10 +28,87 @@ def get_current_user(token: str = Depends(oauth2_scheme)):
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
-@router.post("/encode", response_model=EncodeResponse)
+@router.post("/encode", response_model=EncodeResponse, response_model_exclude_none=True)
 def encode_data(request: EncodeRequest, user: str = Depends(get_current_user)):
-    return encode_text(request.text, request.key)
+    return encode_text(request.text, request.key, request.canonical)
 
 @router.post("/decode", response_model=DecodeResponse)
 def decode_data(request: DecodeRequest, user: str = Depends(get_current_user)):
-    return decode_text(request.encoded_data, request.key, request.huffman_codes, request.padding)
+    if request.huffman_codes is None and request.code_lengths is None:
+        raise HTTPException(status_code=400, detail="Either huffman_codes or code_lengths is required")
+    try:
+        return decode_text(request.encoded_data, request.key, request.huffman_codes, request.padding,
+                           request.code_lengths)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def spool_body(request: Request, validate_text: bool = False) -> SpooledTemporaryFile:
+    # Тело принимается целиком до начала ответа: ошибки входных данных возвращаются как 400,
+    # а не обрывают уже начатый поток
+    spool = SpooledTemporaryFile(max_size=SPOOL_MEMORY_LIMIT)
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    try:
+        async for chunk in request.stream():
+            if validate_text:
+                decoder.decode(chunk)
+            spool.write(chunk)
+        if validate_text:
+            decoder.decode(b"", final=True)
+    except UnicodeDecodeError:
+        spool.close()
+        raise HTTPException(status_code=400, detail="Request body is not valid UTF-8")
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool
+
+def stream_key(key: str) -> str:
+    # Заголовки приходят в latin-1, клиент передает ключ байтами UTF-8
+    try:
+        key = key.encode("latin-1").decode("utf-8")
+    except UnicodeError:
+        raise HTTPException(status_code=400, detail="X-Encryption-Key must be UTF-8")
+    if not key:
+        raise HTTPException(status_code=400, detail="Key must not be empty")
+    return key
+
+def read_chunks(spool: SpooledTemporaryFile):
+    return iter(lambda: spool.read(STREAM_READ_SIZE), b"")
+
+def spooled_chunks(spool: SpooledTemporaryFile):
+    with spool:
+        yield from read_chunks(spool)
+
+def spooled_code_map(spool: SpooledTemporaryFile) -> dict:
+    # Первый проход по принятому телу: общая кодовая книга по частотам всех блоков
+    code_map = shared_code_map(text_blocks(codecs.iterdecode(read_chunks(spool), "utf-8"), STREAM_BLOCK),
+                               block_executor())
+    spool.seek(0)
+    return code_map
+
+@router.post("/encode/stream")
+async def encode_stream_data(request: Request, key: str = Header(..., alias="X-Encryption-Key"),
+                             shared_codebook: bool = False, user: str = Depends(get_current_user)):
+    key = stream_key(key)
+    spool = await spool_body(request, validate_text=True)
+    code_map = await run_in_threadpool(spooled_code_map, spool) if shared_codebook else None
+    text_chunks = codecs.iterdecode(spooled_chunks(spool), "utf-8")
+    return StreamingResponse(encode_stream(text_chunks, key, code_map=code_map, executor=block_executor()),
+                             media_type="application/octet-stream")
+
+@router.post("/decode/stream")
+async def decode_stream_data(request: Request, key: str = Header(..., alias="X-Encryption-Key"),
+                             user: str = Depends(get_current_user)):
+    key = stream_key(key)
+    spool = await spool_body(request)
+    # Структура контейнера проверяется целиком до начала ответа: ошибка посреди потока дала бы
+    # клиенту статус 200 и обрезанный текст
+    try:
+        await run_in_threadpool(check_stream, read_chunks(spool))
+    except ValueError as e:
+        spool.close()
+        raise HTTPException(status_code=400, detail=str(e))
+    spool.seek(0)
+    text = (block.encode("utf-8") for block in decode_stream(spooled_chunks(spool), key, block_executor()))
+    return StreamingResponse(text, media_type="text/plain; charset=utf-8")
@@ -48,13 +48,15 @@ async def websocket_endpoint(websocket: WebSocket, token: str):
                 })
 
                 if operation == "encode":
-                    encode_task.apply_async(args=[request["text"], request["key"]], task_id=task_id)
+                    encode_task.apply_async(args=[request["text"], request["key"], request.get("canonical", False)],
+                                            task_id=task_id)
                 elif operation == "decode":
                     decode_task.apply_async(args=[
                         request["encoded_data"],
                         request["key"],
-                        request["huffman_codes"],
-                        request["padding"]
+                        request.get("huffman_codes"),
+                        request["padding"],
+                        request.get("code_lengths")
                     ], task_id=task_id)
                 else:
                     await websocket.send_json({"status": "ERROR", "message": "Unknown operation"})
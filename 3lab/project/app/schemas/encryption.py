@@ -1,21 +1,24 @@
 
 from pydantic import BaseModel
-from typing import Dict
+from typing import Dict, Optional
 
 class EncodeRequest(BaseModel):
     text: str
     key: str
+    canonical: bool = False
 
 class EncodeResponse(BaseModel):
     encoded_data: str
     key: str
-    huffman_codes: Dict[str, str]
+    huffman_codes: Optional[Dict[str, str]] = None
+    code_lengths: Optional[str] = None
     padding: int
 
 class DecodeRequest(BaseModel):
     encoded_data: str
     key: str
-    huffman_codes: Dict[str, str]
+    huffman_codes: Optional[Dict[str, str]] = None
+    code_lengths: Optional[str] = None
     padding: int
 
 class DecodeResponse(BaseModel):
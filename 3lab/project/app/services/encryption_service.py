@@ -1,8 +1,36 @@
 
+import os
 import heapq
 import base64
-from collections import Counter
-from typing import Dict, Tuple
+import struct
+import threading
+import multiprocessing
+from functools import lru_cache
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Текст кодируется блоками: промежуточные массивы занимают память порядка блока, а не всего текста
+ENCODE_BLOCK = 1 << 16
+
+# Потоковый контейнер: сигнатура, затем кадры блоков (заголовок, кодовая книга, данные).
+# У каждого блока своя каноническая кодовая книга, XOR с ключом начинается заново с начала блока.
+# Кадр с нулевыми длинами завершает поток, так обрезанный поток отличается от полного
+STREAM_MAGIC = b"HXS1"
+STREAM_FRAME = struct.Struct("!IIB")
+STREAM_BLOCK = 1 << 20
+
+# Блоки контейнера кодируются и декодируются в пуле процессов; 0 - по числу доступных ядер
+BLOCK_WORKERS = int(os.getenv("BLOCK_WORKERS", 0))
+
+# Заполненные таблицы декодирования хранятся между запросами, пока в них в сумме не больше стольких строк
+# (строка - около 20 КБ; таблица, которая сейчас используется, в лимит не входит)
+DECODE_CACHE_ROWS = int(os.getenv("DECODE_CACHE_ROWS", 2048))
 
 class Node:
     def __init__(self, char=None, freq=0):
@@ -14,8 +42,31 @@ class Node:
     def __lt__(self, other):
         return self.freq < other.freq
 
+def code_points(text: str):
+    return np.frombuffer(text.encode("utf-32-le", "surrogatepass"), dtype=np.uint32)
+
+def symbol_frequencies(text: str) -> Dict[str, int]:
+    # Порядок символов как у Counter (по первому вхождению), чтобы дерево и коды не зависели от способа подсчета
+    if np is None or not text:
+        return Counter(text)
+    counts = np.zeros(0, dtype=np.int64)
+    first = np.zeros(0, dtype=np.int64)
+    for start in range(0, len(text), ENCODE_BLOCK):
+        points = code_points(text[start:start + ENCODE_BLOCK])
+        size = int(points.max()) + 1
+        if size > len(counts):
+            counts = np.concatenate([counts, np.zeros(size - len(counts), dtype=np.int64)])
+            first = np.concatenate([first, np.full(size - len(first), len(text), dtype=np.int64)])
+        counts[:size] += np.bincount(points, minlength=size)
+        np.minimum.at(first, points, np.arange(start, start + len(points)))
+    present = np.flatnonzero(counts)
+    present = present[np.argsort(first[present], kind="stable")]
+    return {chr(point): int(counts[point]) for point in present}
+
 def build_huffman_tree(text: str) -> Node:
-    frequency = Counter(text)
+    return huffman_tree(symbol_frequencies(text))
+
+def huffman_tree(frequency: Dict[str, int]) -> Node:
     heap = [Node(char, freq) for char, freq in frequency.items()]
     heapq.heapify(heap)
     while len(heap) > 1:
@@ -37,40 +88,318 @@ def generate_codes(node: Node, prefix="", code_map=None) -> Dict[str, str]:
         generate_codes(node.right, prefix + "1", code_map)
     return code_map
 
-def huffman_encode(text: str) -> Tuple[str, Dict[str, str], int]:
+def pack_bits_int(text: str, code_map: Dict[str, str]) -> Tuple[bytes, int]:
+    # Коды блока склеиваются в одно целое, целые байты сразу переносятся в буфер, остаток битов переходит дальше
+    output = bytearray()
+    carry, carry_bits = 0, 0
+    get_code = code_map.__getitem__
+    for start in range(0, len(text), ENCODE_BLOCK):
+        bits = ''.join(map(get_code, text[start:start + ENCODE_BLOCK]))
+        if not bits:
+            continue
+        value = (carry << len(bits)) | int(bits, 2)
+        total = carry_bits + len(bits)
+        carry_bits = total % 8
+        if total >= 8:
+            output += (value >> carry_bits).to_bytes(total // 8, "big")
+        carry = value & ((1 << carry_bits) - 1)
+    padding = (8 - carry_bits) % 8
+    if carry_bits:
+        output.append(carry << padding)
+    return bytes(output), padding
+
+def pack_bits_numpy(text: str, code_map: Dict[str, str]) -> Tuple[bytes, int]:
+    # Каждый код кладется в 64-битные слова по своей позиции в потоке; коды, попавшие в одно слово,
+    # объединяются через bitwise_or.reduceat (номера слов не убывают), перенос в следующее слово - отдельно
+    symbols = list(code_map)
+    codes = np.array([int(code_map[symbol] or "0", 2) for symbol in symbols], dtype=np.uint64)
+    lengths = np.array([len(code_map[symbol]) for symbol in symbols], dtype=np.int64)
+    lookup = np.zeros(max(map(ord, symbols)) + 1, dtype=np.int64)
+    lookup[[ord(symbol) for symbol in symbols]] = np.arange(len(symbols))
+    output = bytearray()
+    carry, carry_bits = np.uint64(0), 0
+    for start in range(0, len(text), ENCODE_BLOCK):
+        index = lookup[code_points(text[start:start + ENCODE_BLOCK])]
+        code, length = codes[index], lengths[index]
+        ends = np.cumsum(length) + carry_bits
+        starts = ends - length
+        total = int(ends[-1])
+        word = starts >> 6
+        spill = starts % 64 + length - 64
+        head = (code >> np.maximum(spill, 0).astype(np.uint64)) << np.maximum(-spill, 0).astype(np.uint64)
+        words = np.zeros((total + 63) >> 6, dtype=np.uint64)
+        bounds = np.flatnonzero(np.r_[True, word[1:] != word[:-1]])
+        words[word[bounds]] = np.bitwise_or.reduceat(head, bounds)
+        split = np.flatnonzero(spill > 0)
+        if len(split):
+            rest = spill[split].astype(np.uint64)
+            words[word[split] + 1] |= (code[split] & ((np.uint64(1) << rest) - np.uint64(1))) << (np.uint64(64) - rest)
+        words[0] |= carry
+        full = total >> 6
+        output += words[:full].astype(">u8").tobytes()
+        carry_bits = total % 64
+        carry = words[full] if carry_bits else np.uint64(0)
+    tail = (carry_bits + 7) // 8
+    if tail:
+        output += (int(carry) >> (64 - tail * 8)).to_bytes(tail, "big")
+    return bytes(output), (8 - carry_bits % 8) % 8
+
+def pack_bits(text: str, code_map: Dict[str, str]) -> Tuple[bytes, int]:
+    # Результат тот же, что у склейки строки из '0'/'1': биты кодов подряд, последний байт дополнен нулями
+    longest = max(map(len, code_map.values()), default=0)
+    if not longest:
+        return b"", 0
+    if np is not None and longest <= 64:
+        return pack_bits_numpy(text, code_map)
+    return pack_bits_int(text, code_map)
+
+def canonical_codes(code_lengths: Dict[str, int]) -> Dict[str, str]:
+    # Канонические коды: символы по (длина, код символа), каждый следующий код на единицу больше предыдущего
+    code_map = {}
+    code, previous = 0, 0
+    for symbol, length in sorted(code_lengths.items(), key=lambda item: (item[1], ord(item[0]))):
+        code <<= length - previous
+        code_map[symbol] = format(code, f"0{length}b")
+        code += 1
+        previous = length
+    if code > 1 << previous:
+        raise ValueError("Code lengths do not form a prefix code")
+    return code_map
+
+def pack_code_lengths_bytes(code_lengths: Dict[str, int]) -> bytes:
+    # Пары (разность кодов символов в порядке возрастания - varint, длина кода - байт)
+    packed = bytearray()
+    previous = -1
+    for point, length in sorted((ord(symbol), length) for symbol, length in code_lengths.items()):
+        if not 0 < length < 256:
+            raise ValueError(f"Unsupported code length: {length}")
+        delta = point - previous - 1
+        while delta >= 0x80:
+            packed.append(delta & 0x7F | 0x80)
+            delta >>= 7
+        packed += bytes((delta, length))
+        previous = point
+    return bytes(packed)
+
+def pack_code_lengths(code_lengths: Dict[str, int]) -> str:
+    return base64.b64encode(pack_code_lengths_bytes(code_lengths)).decode()
+
+def unpack_code_lengths_bytes(packed: bytes) -> Dict[str, int]:
+    code_lengths = {}
+    previous, position = -1, 0
+    while position < len(packed):
+        delta, shift = 0, 0
+        while True:
+            if position >= len(packed) or shift > 21:
+                raise ValueError("Invalid code lengths encoding")
+            byte = packed[position]
+            position += 1
+            delta |= (byte & 0x7F) << shift
+            shift += 7
+            if byte < 0x80:
+                break
+        if position >= len(packed) or not packed[position]:
+            raise ValueError("Invalid code lengths encoding")
+        previous += delta + 1
+        if previous > 0x10FFFF:
+            raise ValueError("Invalid code lengths encoding")
+        code_lengths[chr(previous)] = packed[position]
+        position += 1
+    return code_lengths
+
+def unpack_code_lengths(data: str) -> Dict[str, int]:
+    try:
+        packed = base64.b64decode(data, validate=True)
+    except ValueError:
+        raise ValueError("Invalid code lengths encoding")
+    return unpack_code_lengths_bytes(packed)
+
+def huffman_encode_bytes(text: str, canonical: bool = False) -> Tuple[bytes, Dict[str, str], int]:
     tree = build_huffman_tree(text)
     code_map = generate_codes(tree)
-    encoded_bits = ''.join(code_map[char] for char in text)
-    padding = 8 - len(encoded_bits) % 8 if len(encoded_bits) % 8 != 0 else 0
-    encoded_bits += '0' * padding
-    b = bytearray()
-    for i in range(0, len(encoded_bits), 8):
-        byte = encoded_bits[i:i+8]
-        b.append(int(byte, 2))
-    return base64.b64encode(bytes(b)).decode(), code_map, padding
+    if canonical:
+        # Из дерева берутся только длины; единственному символу нужен хотя бы один бит
+        code_map = canonical_codes({symbol: len(code) or 1 for symbol, code in code_map.items()})
+    packed, padding = pack_bits(text, code_map)
+    return packed, code_map, padding
+
+def huffman_encode(text: str, canonical: bool = False) -> Tuple[str, Dict[str, str], int]:
+    packed, code_map, padding = huffman_encode_bytes(text, canonical)
+    return base64.b64encode(packed).decode(), code_map, padding
+
+# Биты каждого значения байта от старшего к младшему
+BYTE_BITS = [tuple((value >> shift) & 1 for shift in range(7, -1, -1)) for value in range(256)]
+
+class StateWalk:
+    # Заглушка строки для редко посещаемого состояния: байт разбирается побитово по дереву.
+    # Строка из 256 переходов стоит как 256 таких разборов, поэтому строится только после
+    # ROW_VISITS посещений и пока в таблице меньше TABLE_ROWS строк (память таблицы ограничена)
+    __slots__ = ("table", "state", "visits")
+
+    def __init__(self, table: "DecodeTable", state: int):
+        self.table = table
+        self.state = state
+        self.visits = 0
+
+    def __getitem__(self, value: int) -> Tuple[str, int]:
+        self.visits += 1
+        if self.visits >= DecodeTable.ROW_VISITS and self.table.rows < DecodeTable.TABLE_ROWS:
+            return self.table.build_row(self.state)[value]
+        return self.table.step(self.state, value, 8)
+
+class DecodeTable(dict):
+    # Автомат декодирования по байтам: состояние - внутренний узел дерева кодов (0 - корень).
+    # Часто посещаемые состояния получают строку таблицы (256 пар "символы, следующее состояние"),
+    # остальные разбираются побитово (StateWalk), так что подготовка не растет с размером алфавита.
+    # DEAD - недопустимая последовательность битов: дальше, как и раньше, ничего не декодируется
+    DEAD = -1
+    ROW_VISITS = 64
+    TABLE_ROWS = 1024
+
+    def __init__(self, code_map: Dict[str, str]):
+        super().__init__()
+        self.rows = 0
+        dead = self.DEAD
+        self.children = children = [[dead, dead]]
+        self.symbols = symbols = [None]
+        for symbol, code in code_map.items():
+            node = 0
+            for bit in code:
+                branch = children[node]
+                index = bit == "1"
+                node = branch[index]
+                if node == dead:
+                    node = branch[index] = len(children)
+                    children.append([dead, dead])
+                    symbols.append(None)
+            symbols[node] = symbol
+        self[self.DEAD] = [("", self.DEAD)] * 256
+
+    def step(self, state: int, value: int, bits: int) -> Tuple[str, int]:
+        children, symbols = self.children, self.symbols
+        emitted = ""
+        for bit in BYTE_BITS[value][8 - bits:]:
+            state = children[state][bit]
+            if state == self.DEAD:
+                break
+            symbol = symbols[state]
+            if symbol is not None:
+                emitted += symbol
+                state = 0
+        return emitted, state
+
+    def build_row(self, state: int) -> list:
+        row = [self.step(state, value, 8) for value in range(256)]
+        self[state] = row
+        self.rows += 1
+        return row
+
+    def __missing__(self, state: int):
+        walk = StateWalk(self, state)
+        self[state] = walk
+        return walk
+
+class DecodeTableCache:
+    # Таблицы по упакованной кодовой книге (LRU). Память таблицы растет с числом построенных строк,
+    # поэтому кэш ограничен их суммой, а не числом таблиц
+    def __init__(self, max_rows: int):
+        self.max_rows = max_rows
+        self.tables = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, codebook: bytes) -> DecodeTable:
+        with self.lock:
+            table = self.tables.get(codebook)
+            if table is not None:
+                self.tables.move_to_end(codebook)
+            keep = 1 if table is not None else 0
+            rows = sum(cached.rows for cached in self.tables.values())
+            while rows > self.max_rows and len(self.tables) > keep:
+                _, evicted = self.tables.popitem(last=False)
+                rows -= evicted.rows
+        if table is None:
+            table = DecodeTable(canonical_codes(unpack_code_lengths_bytes(codebook)))
+            with self.lock:
+                self.tables[codebook] = table
+        return table
+
+decode_tables = DecodeTableCache(DECODE_CACHE_ROWS)
+
+def canonical_decode_table(code_lengths: str) -> DecodeTable:
+    # Строка длин - это base64 той же упакованной кодовой книги, что и в кадрах потока, кэш у них общий
+    try:
+        packed = base64.b64decode(code_lengths, validate=True)
+    except ValueError:
+        raise ValueError("Invalid code lengths encoding")
+    return decode_tables.get(packed)
+
+def decode_with_table(data: bytes, table: DecodeTable, padding: int) -> str:
+    if not data:
+        return ""
+    if table.symbols[0] is not None:
+        # Единственный символ с пустым кодом: в данных нет ни одного бита
+        return ""
+    # Фрагменты склеиваются поблочно, чтобы список ссылок не рос до размера всего текста
+    decoded = []
+    view = memoryview(data)
+    state = 0
+    for start in range(0, len(view) - 1, ENCODE_BLOCK):
+        block = []
+        append = block.append
+        for byte in view[start:min(start + ENCODE_BLOCK, len(view) - 1)]:
+            symbols, state = table[state][byte]
+            append(symbols)
+        decoded.append("".join(block))
+    symbols, _ = table.step(state, view[-1] >> padding, 8 - padding)
+    decoded.append(symbols)
+    return "".join(decoded)
+
+def huffman_decode_bytes(data: bytes, code_map: Dict[str, str], padding: int) -> str:
+    return decode_with_table(data, DecodeTable(code_map), padding)
 
 def huffman_decode(encoded_data: str, code_map: Dict[str, str], padding: int) -> str:
-    reverse_map = {v: k for k, v in code_map.items()}
-    binary_data = ''.join(f"{byte:08b}" for byte in base64.b64decode(encoded_data))
-    binary_data = binary_data[:-padding] if padding else binary_data
-    current_code = ""
-    decoded_text = ""
-    for bit in binary_data:
-        current_code += bit
-        if current_code in reverse_map:
-            decoded_text += reverse_map[current_code]
-            current_code = ""
-    return decoded_text
+    return huffman_decode_bytes(base64.b64decode(encoded_data), code_map, padding)
 
 def xor_encrypt(data: bytes, key: str) -> bytes:
+    # XOR выполняется блоками по ENCODE_BLOCK байт (кратно длине ключа) с заранее повторенным ключом,
+    # поэтому смещение ключа в каждом блоке одинаковое и ключ размножается один раз
     key_bytes = key.encode()
-    return bytes([b ^ key_bytes[i % len(key_bytes)] for i, b in enumerate(data)])
+    if not data:
+        return b""
+    if not key_bytes:
+        raise ValueError("Key must not be empty")
+    step = max(1, ENCODE_BLOCK // len(key_bytes)) * len(key_bytes)
+    tile = key_bytes * (step // len(key_bytes))
+    if np is not None:
+        values = np.frombuffer(data, dtype=np.uint8)
+        key_values = np.frombuffer(tile, dtype=np.uint8)
+        output = np.empty_like(values)
+        for start in range(0, len(values), step):
+            chunk = values[start:start + step]
+            np.bitwise_xor(chunk, key_values[:len(chunk)], out=output[start:start + len(chunk)])
+        return output.tobytes()
+    # Без NumPy блок и ключ складываются как два больших целых, порядок байтов сохраняется
+    view = memoryview(data).cast("B")
+    key_value = int.from_bytes(tile, "little")
+    output = bytearray()
+    for start in range(0, len(view), step):
+        chunk = view[start:start + step]
+        mask = key_value if len(chunk) == step else int.from_bytes(tile[:len(chunk)], "little")
+        output += (int.from_bytes(chunk, "little") ^ mask).to_bytes(len(chunk), "little")
+    return bytes(output)
 
-def encode_text(text: str, key: str):
-    huff_encoded, code_map, padding = huffman_encode(text)
-    raw_bytes = base64.b64decode(huff_encoded)
-    xor_encrypted = xor_encrypt(raw_bytes, key)
-    encoded_final = base64.b64encode(xor_encrypted).decode()
+def encode_text(text: str, key: str, canonical: bool = False):
+    # Внутри только байты, base64 применяется один раз к итоговому шифротексту
+    packed, code_map, padding = huffman_encode_bytes(text, canonical)
+    encoded_final = base64.b64encode(xor_encrypt(packed, key)).decode("ascii")
+    if canonical:
+        # Вместо словаря кодов передаются только длины, декодер восстанавливает коды сам
+        return {
+            "encoded_data": encoded_final,
+            "key": key,
+            "code_lengths": pack_code_lengths({symbol: len(code) for symbol, code in code_map.items()}),
+            "padding": padding
+        }
     return {
         "encoded_data": encoded_final,
         "key": key,
@@ -78,9 +407,154 @@ def encode_text(text: str, key: str):
         "padding": padding
     }
 
-def decode_text(encoded_data: str, key: str, huffman_codes: Dict[str, str], padding: int):
+def decode_text(encoded_data: str, key: str, huffman_codes: Optional[Dict[str, str]], padding: int,
+                code_lengths: Optional[str] = None):
+    if code_lengths is not None:
+        table = canonical_decode_table(code_lengths)
+    elif huffman_codes is not None:
+        table = DecodeTable(huffman_codes)
+    else:
+        raise ValueError("Either huffman_codes or code_lengths is required")
     encrypted_bytes = base64.b64decode(encoded_data)
     decrypted_bytes = xor_encrypt(encrypted_bytes, key)
-    huff_encoded = base64.b64encode(decrypted_bytes).decode()
-    decoded_text = huffman_decode(huff_encoded, huffman_codes, padding)
+    decoded_text = decode_with_table(decrypted_bytes, table, padding)
     return {"decoded_text": decoded_text}
+
+def text_blocks(chunks: Iterable[str], block_size: int) -> Iterator[str]:
+    # Куски произвольной длины пересобираются в блоки ровно по block_size символов (последний - короче)
+    if block_size < 1:
+        raise ValueError("Block size must be positive")
+    parts, length = [], 0
+    for chunk in chunks:
+        position = 0
+        while position < len(chunk):
+            part = chunk[position:position + block_size - length]
+            position += len(part)
+            parts.append(part)
+            length += len(part)
+            if length == block_size:
+                yield "".join(parts)
+                parts, length = [], 0
+    if parts:
+        yield "".join(parts)
+
+def available_workers() -> int:
+    if BLOCK_WORKERS:
+        return BLOCK_WORKERS
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+@lru_cache(maxsize=1)
+def block_executor() -> Optional[ProcessPoolExecutor]:
+    # Пул создается при первом обращении и живет до конца процесса. Процессам-демонам (воркеры Celery)
+    # запрещено порождать дочерние, там и на одном ядре блоки обрабатываются последовательно
+    workers = available_workers()
+    if workers < 2 or multiprocessing.current_process().daemon:
+        return None
+    return ProcessPoolExecutor(max_workers=workers)
+
+def ordered_map(func: Callable, jobs: Iterable[tuple], executor: Optional[Executor] = None) -> Iterator:
+    # Как executor.map, но задания берутся из итератора по мере выполнения: в работе не больше
+    # двух блоков на процесс, поэтому память ограничена и для потока произвольной длины
+    if executor is None:
+        for job in jobs:
+            yield func(*job)
+        return
+    window = 2 * available_workers()
+    pending = deque()
+    try:
+        for job in jobs:
+            pending.append(executor.submit(func, *job))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+def shared_code_map(blocks: Iterable[str], executor: Optional[Executor] = None) -> Dict[str, str]:
+    # Частоты считаются по блокам параллельно и складываются по порядку блоков,
+    # так порядок символов (и дерево) тот же, что при подсчете по всему тексту сразу
+    frequency = Counter()
+    for block_frequency in ordered_map(symbol_frequencies, ((block,) for block in blocks), executor):
+        frequency.update(block_frequency)
+    if not frequency:
+        return {}
+    code_map = generate_codes(huffman_tree(frequency))
+    return canonical_codes({symbol: len(code) or 1 for symbol, code in code_map.items()})
+
+def encode_frame(block: str, key: str, code_map: Optional[Dict[str, str]] = None) -> bytes:
+    # Без общей кодовой книги блок получает собственную
+    if code_map is None:
+        packed, code_map, padding = huffman_encode_bytes(block, canonical=True)
+    else:
+        packed, padding = pack_bits(block, code_map)
+    codebook = pack_code_lengths_bytes({symbol: len(code) for symbol, code in code_map.items()})
+    payload = xor_encrypt(packed, key)
+    return STREAM_FRAME.pack(len(codebook), len(payload), padding) + codebook + payload
+
+def decode_frame(codebook: bytes, payload: bytes, padding: int, key: str) -> str:
+    return decode_with_table(xor_encrypt(payload, key), decode_tables.get(codebook), padding)
+
+def encode_stream(chunks: Iterable[str], key: str, block_size: int = STREAM_BLOCK,
+                  code_map: Optional[Dict[str, str]] = None, executor: Optional[Executor] = None) -> Iterator[bytes]:
+    # В памяти одновременно находится не больше нескольких блоков текста и их шифротекста
+    if not key:
+        raise ValueError("Key must not be empty")
+    yield STREAM_MAGIC
+    jobs = ((block, key, code_map) for block in text_blocks(chunks, block_size))
+    yield from ordered_map(encode_frame, jobs, executor)
+    yield STREAM_FRAME.pack(0, 0, 0)
+
+class StreamReader:
+    def __init__(self, chunks: Iterable[bytes]):
+        self.chunks = iter(chunks)
+        self.buffer = bytearray()
+
+    def read(self, size: int) -> bytes:
+        while len(self.buffer) < size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                raise ValueError("Unexpected end of stream")
+            self.buffer += chunk
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+def stream_frames(chunks: Iterable[bytes]) -> Iterator[Tuple[bytes, bytes, int]]:
+    reader = StreamReader(chunks)
+    if reader.read(len(STREAM_MAGIC)) != STREAM_MAGIC:
+        raise ValueError("Not an encoded stream")
+    while True:
+        codebook_size, payload_size, padding = STREAM_FRAME.unpack(reader.read(STREAM_FRAME.size))
+        if not codebook_size:
+            if payload_size or padding:
+                raise ValueError("Invalid stream frame")
+            if reader.buffer or any(reader.chunks):
+                raise ValueError("Unexpected data after the end of stream")
+            return
+        if padding > 7:
+            raise ValueError("Invalid stream frame")
+        codebook = reader.read(codebook_size)
+        yield codebook, reader.read(payload_size), padding
+
+def check_stream(chunks: Iterable[bytes]) -> None:
+    # Проход по кадрам без декодирования: после него decode_stream по тем же данным не завершится ошибкой
+    for codebook, _, _ in stream_frames(chunks):
+        canonical_codes(unpack_code_lengths_bytes(codebook))
+
+def decode_stream(chunks: Iterable[bytes], key: str, executor: Optional[Executor] = None) -> Iterator[str]:
+    jobs = ((codebook, payload, padding, key) for codebook, payload, padding in stream_frames(chunks))
+    yield from ordered_map(decode_frame, jobs, executor)
+
+def encode_blocks(text: str, key: str, block_size: int = STREAM_BLOCK, shared_codebook: bool = False,
+                  executor: Optional[Executor] = None) -> bytes:
+    # Блочный режим для текста в памяти: тот же контейнер, что у encode_stream
+    code_map = shared_code_map(text_blocks((text,), block_size), executor) if shared_codebook else None
+    return b"".join(encode_stream((text,), key, block_size, code_map, executor))
+
+def decode_blocks(data: bytes, key: str, executor: Optional[Executor] = None) -> str:
+    return "".join(decode_stream((data,), key, executor))
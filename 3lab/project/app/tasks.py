@@ -15,11 +15,11 @@ celery_app.conf.update(
 )
 
 @celery_app.task(bind=True)
-def encode_task(self, text: str, key: str):
+def encode_task(self, text: str, key: str, canonical: bool = False):
     self.update_state(state='STARTED')
-    return encode_text(text, key)
+    return encode_text(text, key, canonical)
 
 @celery_app.task(bind=True)
-def decode_task(self, encoded_data: str, key: str, huffman_codes: dict, padding: int):
+def decode_task(self, encoded_data: str, key: str, huffman_codes: dict, padding: int, code_lengths: str = None):
     self.update_state(state='STARTED')
-    return decode_text(encoded_data, key, huffman_codes, padding)
+    return decode_text(encoded_data, key, huffman_codes, padding, code_lengths)
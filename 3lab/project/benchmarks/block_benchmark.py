@@ -0,0 +1,58 @@
+import sys
+import time
+import argparse
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.services.encryption_service import available_workers, decode_blocks, encode_blocks, STREAM_BLOCK
+from huffman_benchmark import make_text
+
+# Запуск из каталога project: python benchmarks/block_benchmark.py --size 50 --workers 1 2 4
+# Пропускная способность блочного режима должна расти с числом процессов, пока хватает ядер
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Block-parallel Huffman benchmark")
+    parser.add_argument("--size", type=float, default=20, help="text size in millions of chars")
+    parser.add_argument("--block", type=int, default=STREAM_BLOCK, help="block size in chars")
+    parser.add_argument("--workers", type=int, nargs="+", help="process counts to compare (default: 1 and all cores)")
+    parser.add_argument("--shared-codebook", action="store_true", help="one codebook for all blocks")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    text = make_text(int(args.size * 1_000_000), args.seed)
+    print(f"cores available: {available_workers()}")
+    print(f"{'workers':>8} {'encode, s':>10} {'decode, s':>10} {'enc Mch/s':>10} {'dec Mch/s':>10} {'speedup':>8}")
+    megachars = len(text) / 1_000_000
+    baseline, reference = None, None
+    for workers in args.workers or sorted({1, available_workers()}):
+        executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+        try:
+            if executor is not None:
+                # Процессы пула запускаются заранее, чтобы не учитывать их старт
+                list(executor.map(abs, range(workers)))
+            encoded, encode_time = timed(encode_blocks, text, "key", args.block, args.shared_codebook, executor)
+            decoded, decode_time = timed(decode_blocks, encoded, "key", executor)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        if decoded != text:
+            raise SystemExit(f"Decoded text differs from the source with {workers} workers")
+        if reference is None:
+            reference = encoded
+        elif encoded != reference:
+            raise SystemExit(f"Container differs from the single-process one with {workers} workers")
+        total = encode_time + decode_time
+        baseline = baseline or total
+        print(f"{workers:>8} {encode_time:>10.3f} {decode_time:>10.3f} {megachars / encode_time:>10.1f} "
+              f"{megachars / decode_time:>10.1f} {baseline / total:>8.2f}")
+        del decoded
+
+if __name__ == "__main__":
+    main()
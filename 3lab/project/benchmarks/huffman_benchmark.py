@@ -0,0 +1,116 @@
+import sys
+import time
+import base64
+import random
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.services.encryption_service import huffman_decode, huffman_encode
+
+# Запуск из каталога project: python benchmarks/huffman_benchmark.py --sizes 1 10 100
+# Время на символ должно оставаться примерно постоянным с ростом объема (линейная сложность)
+
+WORDS = ["привет", "мир", "hello", "world", "the", "кот", "data", "encode", "x", "Съешь", "же", "ещё", "этих",
+         "мягких", "французских", "булок", "да", "выпей", "чаю", "quick", "brown", "fox", "2024", "!", ","]
+
+def make_text(size: int, seed: int) -> str:
+    rng = random.Random(seed)
+    parts, length = [], 0
+    while length < size:
+        word = rng.choice(WORDS)
+        parts.append(word)
+        length += len(word) + 1
+    return " ".join(parts)[:size]
+
+def make_alphabet_text(size: int, symbols: int, seed: int) -> str:
+    # Большой алфавит (иероглифы с частотами по закону Ципфа): у дерева кодов тысячи внутренних узлов
+    rng = random.Random(seed)
+    alphabet = [chr(0x4E00 + i) for i in range(symbols)]
+    return "".join(rng.choices(alphabet, [1 / (i + 1) for i in range(symbols)], k=size))
+
+def legacy_decode(encoded_data: str, code_map, padding: int) -> str:
+    # Прежняя реализация: построчное наращивание битовой строки, для сравнения на небольших объемах
+    reverse_map = {v: k for k, v in code_map.items()}
+    binary_data = ''.join(f"{byte:08b}" for byte in base64.b64decode(encoded_data))
+    binary_data = binary_data[:-padding] if padding else binary_data
+    current_code = ""
+    decoded_text = ""
+    for bit in binary_data:
+        current_code += bit
+        if current_code in reverse_map:
+            decoded_text += reverse_map[current_code]
+            current_code = ""
+    return decoded_text
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+def best_time(func, repeat, *args):
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        result, elapsed = timed(func, *args)
+        best = min(best, elapsed)
+    return result, best
+
+def main():
+    parser = argparse.ArgumentParser(description="Huffman encode/decode benchmark")
+    parser.add_argument("--sizes", type=float, nargs="+", default=[1, 10, 100], help="text sizes in millions of chars")
+    parser.add_argument("--legacy-max", type=float, default=2, help="run the legacy decoder up to this size")
+    parser.add_argument("--alphabet", type=int, nargs="+", default=[3000, 20000],
+                        help="distinct symbols for the large-alphabet cases")
+    parser.add_argument("--alphabet-size", type=float, default=1, help="large-alphabet text size in millions of chars")
+    parser.add_argument("--repeat", type=int, default=3, help="large-alphabet runs, best time is reported")
+    parser.add_argument("--max-slowdown", type=float, default=1.5,
+                        help="fail if a large-alphabet decode is this much slower than the legacy decoder")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{'size, M':>8} {'encode, s':>10} {'decode, s':>10} {'enc ns/ch':>10} {'dec ns/ch':>10} {'legacy, s':>10}")
+    rows = []
+    for size in args.sizes:
+        chars = int(size * 1_000_000)
+        text = make_text(chars, args.seed)
+        (encoded, codes, padding), encode_time = timed(huffman_encode, text)
+        decoded, decode_time = timed(huffman_decode, encoded, codes, padding)
+        if decoded != text:
+            raise SystemExit(f"Decoded text differs from the source at size {size}M")
+        legacy = ""
+        if size <= args.legacy_max:
+            legacy_text, legacy_time = timed(legacy_decode, encoded, codes, padding)
+            assert legacy_text == text
+            legacy = f"{legacy_time:.3f}"
+        rows.append((chars, encode_time, decode_time))
+        print(f"{size:>8g} {encode_time:>10.3f} {decode_time:>10.3f} {encode_time / chars * 1e9:>10.1f} "
+              f"{decode_time / chars * 1e9:>10.1f} {legacy:>10}")
+        del text, decoded, encoded
+
+    if len(rows) > 1:
+        (small, _, small_decode), (large, _, large_decode) = rows[0], rows[-1]
+        print(f"decode time per char, largest/smallest: {(large_decode / large) / (small_decode / small):.2f} "
+              f"(1.0 = linear)")
+
+    # Подготовка таблицы декодирования не должна расти с размером алфавита быстрее самого декодирования
+    print(f"\n{'symbols':>8} {'size, M':>8} {'decode, s':>10} {'legacy, s':>10} {'ratio':>8}")
+    failed = []
+    for symbols in args.alphabet:
+        text = make_alphabet_text(int(args.alphabet_size * 1_000_000), symbols, args.seed)
+        encoded, codes, padding = huffman_encode(text)
+        decoded, decode_time = best_time(huffman_decode, args.repeat, encoded, codes, padding)
+        legacy_text, legacy_time = best_time(legacy_decode, args.repeat, encoded, codes, padding)
+        if decoded != text or legacy_text != text:
+            raise SystemExit(f"Decoded text differs from the source with {symbols} symbols")
+        ratio = decode_time / legacy_time
+        print(f"{len(codes):>8} {args.alphabet_size:>8g} {decode_time:>10.3f} {legacy_time:>10.3f} {ratio:>8.2f}")
+        if ratio > args.max_slowdown:
+            failed.append(str(symbols))
+        del text, decoded, legacy_text, encoded
+
+    if failed:
+        raise SystemExit(f"Decode slower than legacy by more than {args.max_slowdown:g}x: {', '.join(failed)} symbols")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import os
+import sys
+import time
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.services import encryption_service
+from app.services.encryption_service import xor_encrypt
+
+# Запуск из каталога project: python benchmarks/xor_benchmark.py --size 10
+# Сравнивает векторный XOR (NumPy и запасной вариант на больших целых) с прежним побайтным
+
+def legacy_xor(data: bytes, key: str) -> bytes:
+    # Прежняя реализация: побайтный XOR в списковом включении
+    key_bytes = key.encode()
+    return bytes([b ^ key_bytes[i % len(key_bytes)] for i, b in enumerate(data)])
+
+def best_time(func, repeat, *args):
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+def main():
+    parser = argparse.ArgumentParser(description="XOR throughput benchmark")
+    parser.add_argument("--size", type=float, default=10, help="buffer size in MB")
+    parser.add_argument("--key", default="секретный ключ")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per implementation, best time is reported")
+    parser.add_argument("--min-speedup", type=float, default=20, help="fail if a vectorized variant is slower")
+    args = parser.parse_args()
+
+    data = os.urandom(int(args.size * 1024 * 1024))
+    expected, legacy_time = best_time(legacy_xor, 1, data, args.key)
+    megabytes = len(data) / 1024 / 1024
+
+    variants = [("bigint", None)]
+    if encryption_service.np is not None:
+        variants.insert(0, ("numpy", encryption_service.np))
+    saved = encryption_service.np
+
+    print(f"{'variant':>8} {'time, s':>10} {'MB/s':>10} {'speedup':>10}")
+    print(f"{'legacy':>8} {legacy_time:>10.4f} {megabytes / legacy_time:>10.1f} {1:>10.1f}")
+    failed = []
+    try:
+        for name, module in variants:
+            encryption_service.np = module
+            result, elapsed = best_time(xor_encrypt, args.repeat, data, args.key)
+            if result != expected:
+                raise SystemExit(f"{name}: output differs from the legacy implementation")
+            speedup = legacy_time / elapsed
+            print(f"{name:>8} {elapsed:>10.4f} {megabytes / elapsed:>10.1f} {speedup:>10.1f}")
+            if speedup < args.min_speedup:
+                failed.append(name)
+    finally:
+        encryption_service.np = saved
+
+    if failed:
+        raise SystemExit(f"Speedup below {args.min_speedup:g}x: {', '.join(failed)}")
+
+if __name__ == "__main__":
+    main()
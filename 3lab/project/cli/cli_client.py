@@ -13,6 +13,7 @@ logging.basicConfig(level=logging.INFO, format="%(message)s")
 
 API_URL = "http://localhost:8000"
 WS_URL = "ws://localhost:8000/ws"
+STREAM_CHUNK_SIZE = 1 << 16
 
 celery_app = Celery(
     "worker",
@@ -109,8 +110,32 @@ async def send_and_poll(task, token):
         print(color_block("[DISCONNECTED]", Fore.RED))
         print(f"Reason: {e}")
 
+def stream_file(operation: str, source: str, target: str, key: str, token: str):
+    # Файл отправляется и принимается кусками, целиком в памяти не держится
+    headers = {"Authorization": f"Bearer {token}", "X-Encryption-Key": key.encode("utf-8")}
+    try:
+        with open(source, "rb") as f, requests.post(f"{API_URL}/api/encryption/{operation}/stream",
+                                                    data=iter(lambda: f.read(STREAM_CHUNK_SIZE), b""),
+                                                    headers=headers, stream=True) as response:
+            if response.status_code != 200:
+                print(color_block("[ERROR]", Fore.RED))
+                print(response.text)
+                return
+            size = 0
+            with open(target, "wb") as out:
+                for chunk in response.iter_content(STREAM_CHUNK_SIZE):
+                    out.write(chunk)
+                    size += len(chunk)
+    except (OSError, requests.RequestException) as e:
+        print(color_block("[ERROR]", Fore.RED))
+        print(f"Reason: {e}")
+        return
+    print(color_block("[COMPLETED]", Fore.GREEN))
+    print(f"{operation}: {source} -> {target} ({size} bytes)")
+    print("-" * 50)
+
 async def run_interactive_session(token: str):
-    print("\nAvailable commands: encode, decode, status, exit\n")
+    print("\nAvailable commands: encode, decode, encode-file, decode-file, status, exit\n")
     while True:
         action = input("> ").strip().lower()
         if action == "exit":
@@ -119,18 +144,22 @@ async def run_interactive_session(token: str):
         elif action == "encode":
             text = input("Enter text: ")
             key = input("Enter key: ")
-            task = {"action": "encode", "text": text, "key": key}
+            canonical = input("Canonical codes (compact code lengths)? [y/N]: ").strip().lower() == "y"
+            task = {"action": "encode", "text": text, "key": key, "canonical": canonical}
             await send_and_poll(task, token)
 
         elif action == "decode":
             encoded_data = input("Enter encoded base64: ")
             key = input("Enter key: ")
-            try:
-                huffman = input("Enter huffman codes (JSON): ")
-                huffman_codes = json.loads(huffman)
-            except json.JSONDecodeError:
-                print(Fore.RED + "Invalid Huffman codes JSON." + Style.RESET_ALL)
-                continue
+            code_lengths = input("Enter code lengths (empty for huffman codes JSON): ").strip() or None
+            huffman_codes = None
+            if code_lengths is None:
+                try:
+                    huffman = input("Enter huffman codes (JSON): ")
+                    huffman_codes = json.loads(huffman)
+                except json.JSONDecodeError:
+                    print(Fore.RED + "Invalid Huffman codes JSON." + Style.RESET_ALL)
+                    continue
             try:
                 padding = int(input("Enter padding: "))
             except ValueError:
@@ -141,10 +170,17 @@ async def run_interactive_session(token: str):
                 "encoded_data": encoded_data,
                 "key": key,
                 "huffman_codes": huffman_codes,
+                "code_lengths": code_lengths,
                 "padding": padding
             }
             await send_and_poll(task, token)
 
+        elif action in ("encode-file", "decode-file"):
+            source = input("Source file: ").strip()
+            target = input("Target file: ").strip()
+            key = input("Enter key: ")
+            stream_file(action.split("-")[0], source, target, key, token)
+
         elif action == "status":
             task_id = input("Enter task_id: ").strip()
             await poll_status(task_id)